@@ -0,0 +1,193 @@
+"""Benchmark the hot paths of the client against a local `MockServer`.
+
+Covers reply decoding, task submission, polling many tasks, paginated
+listing and upload/download throughput. Results are printed as a table and
+can be written as JSON to track regressions between releases:
+
+    python benchmarks/client.py --json results.json
+    python benchmarks/client.py --only decode submit --quick
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from importlib.metadata import PackageNotFoundError, version
+
+from reply_decoding import make_page
+from yidong import MockServer, PollPolicy, YiDong
+from yidong.model import Pagination, TaskContainer, VideoScriptTaskResult
+from yidong.util import decode_reply, reply_adapter
+
+RESULTS: list[dict] = []
+
+
+def record(name: str, metric: str, value: float, unit: str, **params) -> None:
+    RESULTS.append(
+        {"name": name, "params": params, "metric": metric, "value": value, "unit": unit}
+    )
+    args = " ".join(f"{k}={v}" for k, v in params.items())
+    print(f"{name:>10} {args:<36} {metric:>12} {value:>12.2f} {unit}")
+
+
+def make_script_result(n: int) -> bytes:
+    element = {
+        "video_id": "0" * 16,
+        "chapter_id": "1" * 16,
+        "chapter": {"start": 0.0, "stop": 10.0},
+        "data": {"voice_over": "lorem ipsum " * 10, "title": "dolor sit amet"},
+    }
+    data = {"type": "video_script", "styles": [[element] * 10] * n}
+    return json.dumps({"code": 0, "message": "", "data": data}).encode()
+
+
+def bench_decode(quick: bool) -> None:
+    cases = [
+        *(
+            (Pagination[TaskContainer], "tasks", n, make_page(n))
+            for n in (1, 10, 100, 1000)
+        ),
+        *(
+            (VideoScriptTaskResult, "styles", n, make_script_result(n))
+            for n in (1, 10, 100)
+        ),
+    ]
+    for T, key, n, content in cases:
+        reply_adapter(T)
+        number = max(1, (2000 if quick else 20000) // max(1, len(content) // 1000))
+        best = min(
+            timeit.repeat(lambda: decode_reply(T, content), number=number, repeat=5)
+        )
+        record(
+            "decode",
+            "latency",
+            best / number * 1e6,
+            "us",
+            type=T.__name__,
+            **{key: n},
+            bytes=len(content),
+        )
+
+
+def bench_submit(server: MockServer, quick: bool) -> None:
+    n = 200 if quick else 2000
+    for workers in (1, 8, 32):
+        yd = YiDong(api_key=server.api_key, base_url=server.base_url)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(lambda _: yd.ping(), range(n)))
+        elapsed = time.perf_counter() - start
+        record("submit", "throughput", n / elapsed, "tasks/s", tasks=n, workers=workers)
+        yd.close()
+
+
+def bench_poll(server: MockServer, quick: bool) -> None:
+    n = 100 if quick else 1000
+    yd = YiDong(api_key=server.api_key, base_url=server.base_url)
+    refs = [yd.ping() for _ in range(n)]
+    before = server.stats["GET /task"]
+    start = time.perf_counter()
+    yd.wait_tasks(refs, poll_policy=PollPolicy.fixed(0.1))
+    elapsed = time.perf_counter() - start
+    requests = server.stats["GET /task"] - before
+    record("poll", "wall", elapsed, "s", tasks=n, duration=server.default_duration)
+    record("poll", "requests", requests, "req", tasks=n)
+    yd.close()
+
+
+def bench_list(server: MockServer, quick: bool) -> None:
+    n = 1000 if quick else 10000
+    yd = YiDong(api_key=server.api_key, base_url=server.base_url)
+    missing = n - yd.list_task(page_size=1).total
+    with ThreadPoolExecutor(32) as executor:
+        list(executor.map(lambda _: yd.ping(), range(missing)))
+    for prefetch in (0, 4, 16):
+        start = time.perf_counter()
+        count = sum(1 for _ in yd.list_task_iter(page_size=100, prefetch=prefetch))
+        elapsed = time.perf_counter() - start
+        record(
+            "list",
+            "throughput",
+            count / elapsed,
+            "tasks/s",
+            tasks=count,
+            prefetch=prefetch,
+        )
+    yd.close()
+
+
+def bench_transfer(server: MockServer, quick: bool) -> None:
+    size = (8 if quick else 64) * 1024 * 1024
+    yd = YiDong(api_key=server.api_key, base_url=server.base_url)
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, "src.bin")
+        with open(src, "wb") as f:
+            f.write(os.urandom(size))
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            res = yd.add_resource(src)
+            times.append(time.perf_counter() - start)
+        mb = size / 1024 / 1024
+        record("upload", "throughput", mb / statistics.median(times), "MB/s", mb=mb)
+
+        times = []
+        for i in range(3):
+            start = time.perf_counter()
+            yd.download_resource(res.id, os.path.join(d, f"dst{i}.bin"))
+            times.append(time.perf_counter() - start)
+        record("download", "throughput", mb / statistics.median(times), "MB/s", mb=mb)
+    yd.close()
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "submit": bench_submit,
+    "poll": bench_poll,
+    "list": bench_list,
+    "transfer": bench_transfer,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="smaller sizes")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    server = MockServer(default_duration=args.duration, latency=args.latency)
+    with server:
+        for name in args.only or BENCHMARKS:
+            fn = BENCHMARKS[name]
+            fn(args.quick) if name == "decode" else fn(server, args.quick)
+
+    if args.json:
+        try:
+            yidong_version = version("yidong")
+        except PackageNotFoundError:
+            yidong_version = None
+        meta = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "yidong": yidong_version,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "latency": args.latency,
+            "duration": args.duration,
+        }
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": RESULTS}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
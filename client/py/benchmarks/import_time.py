@@ -0,0 +1,105 @@
+"""Measure the cold start of the library and of the `yidong` CLI.
+
+Each statement runs in a fresh interpreter and the best of `--repeat` runs is
+reported, along with the slowest modules imported by `from yidong import YiDong`.
+Before timing, a few CLI commands which call other methods of the client are
+run against a `MockServer` to make sure the trimmed CLI still works.
+
+    python benchmarks/import_time.py
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from yidong import MockServer
+
+STATEMENTS = {
+    "import yidong": "import yidong",
+    "from yidong import YiDong": "from yidong import YiDong",
+    "from yidong import AsyncYiDong": "from yidong import AsyncYiDong",
+    "yidong get_task -h": (
+        "import sys; from yidong.client import main; "
+        "sys.argv = ['yidong', 'get_task', '-h']; main()"
+    ),
+}
+
+
+def run(statement: str) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", statement],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        env=os.environ | {"PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    return time.perf_counter() - start
+
+
+def slowest_imports(statement: str, n: int) -> list[tuple[int, str]]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines()[1:]:
+        self_us, _, name = line.split("|")
+        rows.append((int(self_us.split(":")[1]), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+def check_cli() -> None:
+    with MockServer(default_duration=0) as server, tempfile.TemporaryDirectory() as d:
+        env = os.environ | {
+            "YIDONG_API_KEY": server.api_key,
+            "YIDONG_BASE_URL": server.base_url,
+        }
+
+        def cli(*args: str) -> str:
+            return subprocess.run(
+                [sys.executable, "-m", "yidong.client", *args],
+                check=True,
+                capture_output=True,
+                text=True,
+                env=env,
+            ).stdout
+
+        src = os.path.join(d, "a.txt")
+        with open(src, "w") as f:
+            f.write("hello")
+        # each of these calls another public method of the client
+        rid = cli("add_resource", "--file", src).split("id='")[1].split("'")[0]
+        dst = os.path.join(d, "b.txt")
+        cli("download_resource", rid, "--path", dst)
+        with open(dst) as f:
+            assert f.read() == "hello", "download_resource returned wrong content"
+        assert "Resource(" in cli("add_resources", os.path.join(d, "*.txt"))
+        cli("list_task_iter", "--limit", "1")
+    print("cli commands ok\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    check_cli()
+    baseline = min(run("pass") for _ in range(args.repeat))
+    print(f"{'statement':>32} {'wall':>9} {'- python':>9}")
+    for name, statement in STATEMENTS.items():
+        best = min(run(statement) for _ in range(args.repeat))
+        print(f"{name:>32} {best * 1e3:>7.0f}ms {(best - baseline) * 1e3:>7.0f}ms")
+
+    print("\nslowest imports of `from yidong import YiDong` (self time):")
+    for us, name in slowest_imports("from yidong import YiDong", args.top):
+        print(f"{us / 1e3:>8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare decoding `Pagination[TaskContainer]` replies with the old
+`Reply[T].parse_raw` path against the cached `decode_reply`.
+
+    python benchmarks/reply_decoding.py
+"""
+
+import json
+import timeit
+import warnings
+from typing import Any
+
+from pydantic import ValidationError
+from yidong.model import Pagination, Reply, TaskContainer
+from yidong.util import decode_reply, reply_adapter
+
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+
+def make_page(n: int) -> bytes:
+    tasks = [
+        {
+            "id": f"{i:032x}",
+            "task": {"type": "video_summary", "video_id": f"{i:016x}"},
+            "result": {
+                "type": "video_summary",
+                "video_id": f"{i:016x}",
+                "video_summary": {"summary": "lorem ipsum " * 20, "meta": {}},
+                "chapters": [
+                    {"start": j * 10.0, "stop": j * 10.0 + 10} for j in range(8)
+                ],
+                "chapters_ids": [f"{j:016x}" for j in range(8)],
+                "chapter_summaries": [{"summary": "dolor sit amet " * 10}] * 8,
+            },
+            "records": [
+                {"time": "2024-10-25T18:23:13.021277", "type": t}
+                for t in ("created", "submitted", "pending", "processing", "success")
+            ],
+        }
+        for i in range(n)
+    ]
+    data = {"page": 1, "page_size": n, "total": n, "list": tasks}
+    return json.dumps({"code": 0, "message": "", "data": data}).encode()
+
+
+def parse_raw(T, content: bytes):
+    try:
+        return Reply[T].parse_raw(content).data
+    except ValidationError:
+        return Reply[Any].parse_raw(content)
+
+
+def main():
+    T = Pagination[TaskContainer]
+    reply_adapter(T)  # compile once, outside of the timing
+    error = json.dumps({"code": 1001, "message": "invalid api key", "data": None})
+    print(f"{'payload':>24} {'parse_raw':>12} {'decode_reply':>12} {'speedup':>8}")
+    for name, content, fn in [
+        *((f"{n} tasks", make_page(n), decode_reply) for n in (1, 10, 100, 1000)),
+        ("error reply", error.encode(), None),
+    ]:
+        number = max(1, 20000 // max(1, len(content) // 1000))
+
+        def new():
+            try:
+                decode_reply(T, content)
+            except Exception:
+                pass
+
+        old = min(timeit.repeat(lambda: parse_raw(T, content), number=number, repeat=5))
+        cur = min(timeit.repeat(new, number=number, repeat=5))
+        print(
+            f"{name:>24} {old / number * 1e6:>10.1f}us {cur / number * 1e6:>10.1f}us {old / cur:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,65 @@
-from yidong.client import *
-from yidong.model import *
+import importlib
+
+# Submodules are imported on first attribute access, so that e.g.
+# `from yidong import YiDong` does not pay for the webhook server or the
+# asyncio client.
+_SUBMODULES = [
+    "model",
+    "client",
+    "async_client",
+    "batching",
+    "metrics",
+    "mock_server",
+    "pipeline",
+    "polling",
+    "ratelimit",
+    "retry",
+    "webhook",
+]
+
+_LAZY = {
+    "YiDong": "client",
+    "AsyncYiDong": "async_client",
+    "BatchLoader": "batching",
+    "Metrics": "metrics",
+    "MockServer": "mock_server",
+    "Pipeline": "pipeline",
+    "PollPolicy": "polling",
+    "RateLimiter": "ratelimit",
+    "RetryPolicy": "retry",
+    "RetryEvent": "retry",
+    "WebhookReceiver": "webhook",
+}
+
+
+def _public_names(module) -> list[str]:
+    return [k for k in vars(module) if k[0] != "_"]
+
+
+def __getattr__(name: str):
+    if name == "__all__":
+        return sorted(
+            {
+                k
+                for m in _SUBMODULES
+                for k in _public_names(importlib.import_module(f"yidong.{m}"))
+            }
+        )
+    if name in _LAZY:
+        return getattr(importlib.import_module(f"yidong.{_LAZY[name]}"), name)
+    if name[0] != "_":
+        # any submodule, e.g. `yidong.cache` or `yidong.util`
+        try:
+            return importlib.import_module(f"yidong.{name}")
+        except ModuleNotFoundError as e:
+            if e.name != f"yidong.{name}":
+                raise
+        for m in _SUBMODULES:
+            module = importlib.import_module(f"yidong.{m}")
+            if name in vars(module):
+                return getattr(module, name)
+    raise AttributeError(f"module 'yidong' has no attribute '{name}'")
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,1048 @@
+import asyncio
+import io
+import mimetypes
+import os
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
+from time import time
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Iterable,
+)
+from urllib.parse import urlparse
+
+import httpx
+from yidong.batching import AsyncBatchLoader
+from yidong.cache import (
+    FORCE_RERUN,
+    ResourceCache,
+    TaskCache,
+    TaskMemo,
+    UploadIndex,
+    client_scope,
+    is_reusable,
+    merge_cached_tasks,
+    task_key,
+)
+from yidong.config import CONFIG, HTTPConfig
+from yidong.exception import (
+    YDDownloadError,
+    YDError,
+    YDInternalServerError,
+    YDResourceNotUploadedError,
+    YDUnknownError,
+    YDUploadError,
+)
+from yidong.metrics import STORAGE, Metrics, endpoint, error_code
+from yidong.model import (
+    TASK_REGISTRY,
+    Chapter,
+    DiffusionConfig,
+    EditorConfig,
+    ImageGenerationTask,
+    ImageGenerationTaskResult,
+    ImageInpaintTask,
+    ImageInpaintTaskResult,
+    ImageRemoveTask,
+    ImageRemoveTaskResult,
+    Pagination,
+    PingTask,
+    PingTaskResult,
+    Resource,
+    ResourceUploadResponse,
+    T,
+    TaskContainer,
+    TaskInfo,
+    VideoConcatTask,
+    VideoConcatTaskResult,
+    VideoGenerationTask,
+    VideoGenerationTaskResult,
+    VideoMashupTask,
+    VideoMashupTaskResult,
+    VideoScriptTask,
+    VideoScriptTaskElement,
+    VideoScriptTaskResult,
+    VideoScriptTaskResultElement,
+    VideoSnapshotTask,
+    VideoSnapshotTaskResult,
+    VideoSummaryTask,
+    VideoSummaryTaskResult,
+    WebhookResponse,
+)
+from yidong.polling import (
+    PollPolicy,
+    ProgressHandler,
+    default_poll_policy,
+    report_progress,
+)
+from yidong.ratelimit import RateLimiter, default_rate_limiter
+from yidong.retry import IDEMPOTENT_METHODS, RetryHook, RetryPolicy, notify_retry
+from yidong.util import (
+    DOWNLOAD_CHUNK_SIZE,
+    LOOKUP_PAGE_SIZE,
+    RESOURCE_SOURCES,
+    UPLOAD_CHUNK_SIZE,
+    AsyncBatchIter,
+    AsyncPaginationIter,
+    AsyncResourceRef,
+    AsyncTaskRef,
+    DownloadState,
+    MaskLike,
+    ProgressCallback,
+    aiter_file,
+    check_upload_response,
+    decode_image,
+    decode_reply,
+    expand_paths,
+    resolve_mask,
+    resource_file_name,
+    snapshot_ids,
+)
+
+_TASK_REFS = {k: AsyncTaskRef[t, r] for k, (t, r) in TASK_REGISTRY.items()}
+
+
+class AsyncYiDong:
+    """The asyncio counterpart of `YiDong`.
+
+    Every method of `YiDong` is available here as a coroutine. Task submitters
+    return an `AsyncTaskRef` which can be awaited directly to get the result.
+
+    Example:
+
+        async with AsyncYiDong() as yd:
+            t = await yd.video_summary("b525d791a0a5a023")
+            result = await t
+    """
+
+    _client: httpx.AsyncClient
+
+    def __init__(
+        self,
+        api_key: str = CONFIG.api_key,
+        base_url: str = CONFIG.base_url,
+        upload_index: UploadIndex | None = None,
+        retry_policy: RetryPolicy | None = None,
+        on_retry: RetryHook | None = None,
+        rate_limiter: RateLimiter | None = None,
+        http_config: HTTPConfig | None = None,
+        storage_http_config: HTTPConfig | None = None,
+        task_cache: TaskCache | None = None,
+        task_memo: TaskMemo | None = None,
+        metrics: Metrics | None = None,
+        resource_cache: ResourceCache | None = None,
+        coalesce_window: float | None = None,
+    ) -> None:
+        """Initialize the Client
+
+        Args:
+            base_url: The base url of the server.
+            api_key: The api key for authentication.
+            upload_index: If provided, local files whose content has been
+                uploaded before are not uploaded again and the existing
+                resource is returned instead. By default an index under
+                `CONFIG.cache_dir` is used if `CONFIG.upload_dedup` is set.
+            retry_policy: When to retry failed API requests. By default up to
+                `CONFIG.max_retries` retries are made.
+            on_retry: Called with a `RetryEvent` before each retry.
+            rate_limiter: Every API request, upload and download passes
+                through it. Share one limiter between clients to stay under a
+                common limit. By default the process wide limiter configured
+                by `CONFIG.rate_limit` and `CONFIG.max_in_flight` is used.
+            http_config: Connection pool, HTTP/2 and timeout settings of API
+                requests. Defaults to `CONFIG.http`.
+            storage_http_config: The same settings for uploads and downloads
+                of resource files, which usually need much longer read and
+                write timeouts. Defaults to `CONFIG.storage_http`.
+            task_cache: If provided, finished tasks are stored locally and
+                `get_task`, `TaskRef` and `list_task(ids=...)` only fetch the
+                tasks which are not cached yet. By default a cache under
+                `CONFIG.cache_dir` is used if `CONFIG.task_cache` is set.
+            task_memo: If provided, submitting a task identical to one
+                submitted within `task_memo.ttl` seconds returns the existing
+                task instead, unless it has failed or the call is made inside
+                `yidong.cache.force_rerun()`. By default a memo under
+                `CONFIG.cache_dir` is used if `CONFIG.task_memo` is set.
+            metrics: If provided, the latency, bytes and status of requests,
+                uploads and downloads, retries, errors and the queued and
+                running time of finished tasks are recorded into it.
+            resource_cache: If provided, `get_resource` serves resources
+                looked up recently from memory until they expire or are
+                updated or deleted through this client. By default one is
+                created if `CONFIG.resource_cache` is set.
+            coalesce_window: If greater than 0, `get_resource` and `get_task`
+                calls made within this many seconds of each other are
+                resolved together by one `list_resource(ids=...)` or
+                `list_task(ids=...)` request, and concurrent calls with the
+                same id share one request. Defaults to `CONFIG.coalesce_window`.
+        """
+        self._rate_limiter = rate_limiter or default_rate_limiter() or nullcontext()
+        self._retry_policy = retry_policy or RetryPolicy(max_retries=CONFIG.max_retries)
+        self._on_retry = on_retry
+        if upload_index is None and CONFIG.upload_dedup:
+            upload_index = UploadIndex()
+        self._upload_index = upload_index
+        if task_cache is None and CONFIG.task_cache:
+            task_cache = TaskCache()
+        self._task_cache = task_cache
+        if task_memo is None and CONFIG.task_memo:
+            task_memo = TaskMemo()
+        self._task_memo = task_memo
+        self._metrics = metrics
+        if resource_cache is None and CONFIG.resource_cache:
+            resource_cache = ResourceCache()
+        self._resource_cache = resource_cache
+        self._scope = client_scope(base_url, api_key)
+        if coalesce_window is None:
+            coalesce_window = CONFIG.coalesce_window
+        self._resource_loader = self._task_loader = None
+        if coalesce_window > 0:
+            self._resource_loader = AsyncBatchLoader[str, Resource](
+                self._fetch_resources, self._fetch_resource, coalesce_window
+            )
+            self._task_loader = AsyncBatchLoader[str, TaskContainer](
+                self._fetch_tasks, self._fetch_task, coalesce_window
+            )
+        http_config = http_config or CONFIG.http
+        storage_http_config = storage_http_config or CONFIG.storage_http
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={CONFIG.api_key_header: api_key},
+            **http_config.client_kwargs(),
+        )
+        # pre-signed storage urls must not receive the api key
+        self._storage_client = httpx.AsyncClient(
+            follow_redirects=True, **storage_http_config.client_kwargs()
+        )
+
+    async def __aenter__(self) -> "AsyncYiDong":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+        await self._storage_client.aclose()
+
+    async def _send(
+        self, method: str, path: str, *, idempotent: bool | None = None, **kwargs
+    ) -> httpx.Response:
+        """Send a request to the API server, retrying according to the retry policy."""
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        metrics = self._metrics
+        label = endpoint(method, path) if metrics is not None else None
+        attempt = 0
+        while True:
+            resp = error = None
+            try:
+                async with self._rate_limiter:
+                    start = time()
+                    resp = await self._client.request(method, path, **kwargs)
+                if metrics is not None:
+                    metrics.observe(label, start, resp, received=len(resp.content))
+                if not self._retry_policy.should_retry(attempt, idempotent, resp):
+                    return resp
+            except httpx.TransportError as e:
+                if metrics is not None:
+                    metrics.observe(label, start, error=e)
+                if not self._retry_policy.should_retry(attempt, idempotent, error=e):
+                    raise
+                error = e
+            if metrics is not None:
+                metrics.on_retry(label)
+            delay = self._retry_policy.delay(attempt, resp)
+            notify_retry(self._on_retry, method, path, attempt, delay, resp, error)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _request(
+        self,
+        T: type[T],
+        method: str,
+        path: str,
+        *,
+        params: dict | None = None,
+        payload: dict | None = None,
+        headers: dict | None = None,
+        content: str | bytes | AsyncIterable[bytes] | None = None,
+        idempotent: bool | None = None,
+    ) -> T:
+        try:
+            resp = await self._send(
+                method,
+                path,
+                idempotent=idempotent,
+                params=params,
+                json=payload,
+                headers=headers,
+                content=content,
+            )
+            resp.raise_for_status()
+            return decode_reply(T, resp.content)
+        except httpx.HTTPStatusError as e:
+            error = YDInternalServerError(e.response.status_code, e.response.text)
+            if self._metrics is not None:
+                self._metrics.on_error(endpoint(method, path), error.status_code)
+            raise error
+        except YDError as e:
+            if self._metrics is not None:
+                self._metrics.on_error(endpoint(method, path), error_code(e))
+            raise
+
+    async def add_resource(
+        self,
+        file: str | None = None,
+        content_type: str | None = None,
+        *,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        max_retries: int = 3,
+        progress: ProgressCallback | None = None,
+    ) -> Resource | AsyncResourceRef:
+        """Add a resource to the server. See `YiDong.add_resource`."""
+        if file is None:
+            r = await self._send(
+                "put",
+                f"/resource",
+                headers={"Content-Type": content_type or "application/octet-stream"},
+            )
+            if r.status_code == 307:
+                return AsyncResourceRef(
+                    self,
+                    r.headers["x-yds-resource-id"],
+                    upload_url=r.headers["Location"],
+                )
+            else:
+                raise YDError(1, "Failed to get pre-signed url", r.text)
+        elif os.path.exists(file):
+            digest = None
+            if self._upload_index is not None:
+                digest = await asyncio.to_thread(self._upload_index.digest, file)
+                if res := await self._get_uploaded(digest):
+                    return res
+            headers = {
+                "Content-Type": content_type
+                or mimetypes.guess_type(file)[0]
+                or "application/octet-stream"
+            }
+            r = await self._send(
+                "put",
+                f"/resource",
+                headers=headers,
+                params={"file": file},
+            )
+            if r.status_code == 307:
+                rid = r.headers["x-yds-resource-id"]
+                url = r.headers["Location"]
+                await self._upload(
+                    url, file, headers, chunk_size, max_retries, progress
+                )
+                res = await self.get_resource(rid)
+                if digest:
+                    self._upload_index.put(self._scope, digest, rid)
+                return res
+            else:
+                raise YDError(1, "Failed to get pre-signed url", r.text)
+        else:
+            o = urlparse(file)
+            if o.scheme in ["http", "https"]:
+                r = await self._request(
+                    ResourceUploadResponse, "put", f"/resource", params={"file": file}
+                )
+                return AsyncResourceRef(self, r.id)
+            else:
+                raise FileNotFoundError(f"File not found: {file}")
+
+    def add_resources(
+        self,
+        files: str | list[str],
+        content_type: str | None = None,
+        *,
+        max_workers: int = 8,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        max_retries: int = 3,
+    ) -> AsyncBatchIter[Resource | AsyncResourceRef]:
+        """Add many resources concurrently. See `YiDong.add_resources`."""
+        return AsyncBatchIter[Resource | AsyncResourceRef](
+            lambda f: self.add_resource(
+                f, content_type, chunk_size=chunk_size, max_retries=max_retries
+            ),
+            expand_paths(files),
+            max_workers,
+        )
+
+    async def _get_uploaded(self, digest: str) -> Resource | None:
+        if rid := self._upload_index.get(self._scope, digest):
+            try:
+                return await self.get_resource(rid)
+            except (
+                YDUnknownError,
+                YDInternalServerError,
+                YDResourceNotUploadedError,
+            ):
+                # the resource is gone or broken on the server side
+                self._upload_index.invalidate(self._scope, rid)
+        return None
+
+    async def _upload(
+        self,
+        url: str,
+        file: str,
+        headers: dict,
+        chunk_size: int,
+        max_retries: int,
+        progress: ProgressCallback | None,
+    ) -> None:
+        # pre-signed urls do not accept chunked transfer encoding
+        headers = headers | {"Content-Length": str(os.path.getsize(file))}
+        metrics = self._metrics
+        retries = 0
+        while True:
+            r = error = None
+            try:
+                async with self._rate_limiter:
+                    start = time()
+                    r = await self._storage_client.put(
+                        url,
+                        content=aiter_file(file, chunk_size, progress),
+                        headers=headers,
+                    )
+                if metrics is not None:
+                    metrics.observe(f"PUT {STORAGE}", start, r)
+                if check_upload_response(url, r, retries < max_retries):
+                    return
+            except httpx.TransportError as e:
+                if metrics is not None:
+                    metrics.observe(f"PUT {STORAGE}", start, error=e)
+                if retries >= max_retries:
+                    raise YDUploadError(url, str(e)) from e
+                error = e
+            except YDUploadError:
+                if metrics is not None:
+                    metrics.on_error(f"PUT {STORAGE}", r.status_code)
+                raise
+            if metrics is not None:
+                metrics.on_retry(f"PUT {STORAGE}")
+            # honours `Retry-After` of the storage service
+            delay = self._retry_policy.delay(retries, r)
+            notify_retry(
+                self._on_retry, "PUT", url.partition("?")[0], retries, delay, r, error
+            )
+            await asyncio.sleep(delay)
+            retries += 1
+
+    async def update_resource(
+        self, id: str, name: str | None = None, mime: str | None = None
+    ) -> Resource:
+        """Update the resource with the given id. See `YiDong.update_resource`."""
+        r = await self._request(
+            Resource, "patch", f"/resource/{id}", payload={"name": name, "mime": mime}
+        )
+        if self._resource_cache is not None:
+            self._resource_cache.put(self._scope, r)
+        return r
+
+    async def list_resource(
+        self,
+        page: int = 1,
+        page_size: int = 10,
+        source: list[str] = ["local_upload", "remote_download"],
+        ids: list[str] | None = None,
+    ) -> Pagination[Resource]:
+        """Retrieve resources in `page`. See `YiDong.list_resource`."""
+        params = {"page": page, "page_size": page_size, "source": source}
+        if ids:
+            params["ids"] = ids
+        res = await self._request(
+            Pagination[Resource],
+            "get",
+            "/resource",
+            params=params,
+        )
+        if self._resource_cache is not None:
+            self._resource_cache.put_many(self._scope, res.list)
+        return res
+
+    def list_resource_iter(
+        self,
+        page_size: int = 100,
+        prefetch: int = 4,
+        limit: int | None = None,
+        **kwargs,
+    ) -> AsyncPaginationIter[Resource]:
+        """See `YiDong.list_resource_iter`."""
+        return AsyncPaginationIter[Resource](
+            lambda p: self.list_resource(page=p, page_size=page_size, **kwargs),
+            prefetch=prefetch,
+            limit=limit,
+        )
+
+    async def get_resource(self, id: str) -> Resource:
+        if self._resource_cache is not None:
+            if r := self._resource_cache.get(self._scope, id):
+                return r
+        if self._resource_loader is not None:
+            return await self._resource_loader.load(id)
+        return await self._fetch_resource(id)
+
+    async def _fetch_resource(self, id: str) -> Resource:
+        r = await self._request(Resource, "get", f"/resource/{id}")
+        if self._resource_cache is not None:
+            self._resource_cache.put(self._scope, r)
+        return r
+
+    async def _fetch_resources(self, ids: list[str]) -> dict[str, Resource]:
+        page = await self.list_resource(
+            page_size=len(ids), source=RESOURCE_SOURCES, ids=ids
+        )
+        # leave resources which are not uploaded to `get_resource`, which raises
+        return {r.id: r for r in page.list if r.uploaded_at}
+
+    async def download_resource(
+        self,
+        id: str,
+        path: str | BinaryIO | None = None,
+        *,
+        resume: bool = True,
+        max_retries: int = 3,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        expected_size: int | None = None,
+        checksum: str | None = None,
+        checksum_algorithm: str = "sha256",
+    ) -> str | BinaryIO:
+        """Stream the resource to a local path or a file-like object. See `YiDong.download_resource`."""
+        download = lambda r: self._download_resource(
+            r,
+            path,
+            resume,
+            max_retries,
+            chunk_size,
+            expected_size,
+            checksum,
+            checksum_algorithm,
+        )
+        try:
+            return await download(await self.get_resource(id))
+        except YDDownloadError as e:
+            if self._resource_cache is None or e.status_code not in (401, 403):
+                raise
+            # the url of the cached resource was revoked or expired early
+            self._resource_cache.invalidate(self._scope, id)
+            return await download(await self.get_resource(id))
+
+    async def _download_resource(
+        self,
+        r: Resource,
+        path: str | BinaryIO | None,
+        resume: bool = True,
+        max_retries: int = 3,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        expected_size: int | None = None,
+        checksum: str | None = None,
+        checksum_algorithm: str = "sha256",
+    ) -> str | BinaryIO:
+        if path is not None and not isinstance(path, (str, os.PathLike)):
+            state = DownloadState(r.url, path, None, checksum, checksum_algorithm)
+            await self._download(state, max_retries, chunk_size)
+            state.verify(expected_size)
+            return path
+
+        path = path or resource_file_name(r)
+        # keyed by the resource, so a leftover of another one is never resumed
+        part = f"{path}.{r.id}.part"
+        with open(part, "a+b" if resume else "w+b") as f:
+            state = DownloadState(r.url, f, 0, checksum, checksum_algorithm)
+            await self._download(state, max_retries, chunk_size)
+            try:
+                state.verify(expected_size)
+            except YDDownloadError:
+                state.restart()
+                raise
+        os.replace(part, path)
+        return path
+
+    async def _download(
+        self, state: DownloadState, max_retries: int, chunk_size: int
+    ) -> None:
+        metrics = self._metrics
+        label = f"GET {STORAGE}"
+        retries = 0
+        while True:
+            start, received, resp = time(), state.received, None
+            try:
+                async with self._rate_limiter, self._storage_client.stream(
+                    "GET", state.url, headers=state.headers()
+                ) as resp:
+                    if state.start(resp):
+                        async for chunk in resp.aiter_bytes(chunk_size):
+                            state.write(chunk)
+                if metrics is not None:
+                    metrics.observe(
+                        label, start, resp, received=state.received - received
+                    )
+                if state.is_complete():
+                    return
+                raise httpx.ReadError("incomplete body")
+            except httpx.HTTPStatusError as e:
+                resp, error = e.response, None
+                if metrics is not None:
+                    metrics.observe(label, start, resp)
+                status = resp.status_code
+                if retries >= max_retries or (status != 429 and status < 500):
+                    if metrics is not None:
+                        metrics.on_error(label, status)
+                    raise YDDownloadError(state.url, f"HTTP {status}", status)
+            except httpx.TransportError as e:
+                resp, error = None, e
+                if metrics is not None:
+                    metrics.observe(label, start, error=e)
+                if retries >= max_retries:
+                    raise YDDownloadError(state.url, str(e)) from e
+            if metrics is not None:
+                metrics.on_retry(label)
+            # honours `Retry-After` of the storage service
+            delay = self._retry_policy.delay(retries, resp)
+            notify_retry(
+                self._on_retry,
+                "GET",
+                state.url.partition("?")[0],
+                retries,
+                delay,
+                resp,
+                error,
+            )
+            await asyncio.sleep(delay)
+            retries += 1
+
+    def _snapshot_batch(
+        self,
+        snapshots: VideoSnapshotTaskResult | list[str],
+        fn: Callable[[int, Resource], Awaitable[T]],
+        max_workers: int,
+    ) -> AsyncBatchIter[T]:
+        ids = snapshot_ids(snapshots)
+        index = {id: i for i, id in enumerate(ids)}
+        resources: dict[str, Resource] = {}
+
+        async def items() -> AsyncIterator[str]:
+            for i in range(0, len(ids), LOOKUP_PAGE_SIZE):
+                chunk = ids[i : i + LOOKUP_PAGE_SIZE]
+                page = await self.list_resource(
+                    page_size=len(chunk), source=RESOURCE_SOURCES, ids=chunk
+                )
+                resources.update((r.id, r) for r in page.list)
+                for id in chunk:
+                    yield id
+
+        async def run(id: str) -> T:
+            r = resources.pop(id, None) or await self.get_resource(id)
+            return await fn(index[id], r)
+
+        return AsyncBatchIter[T](run, items(), max_workers, ordered=True)
+
+    def download_snapshots(
+        self,
+        snapshots: VideoSnapshotTaskResult | list[str],
+        path: str = ".",
+        *,
+        max_workers: int = 8,
+        max_retries: int = 3,
+    ) -> AsyncBatchIter[str]:
+        """Download the frames of a `video_snapshot` task into a directory. See `YiDong.download_snapshots`."""
+        os.makedirs(path, exist_ok=True)
+
+        async def download(i: int, r: Resource) -> str:
+            ext = os.path.splitext(resource_file_name(r))[1]
+            return await self._download_resource(
+                r, os.path.join(path, f"{i:06d}{ext}"), max_retries=max_retries
+            )
+
+        return self._snapshot_batch(snapshots, download, max_workers)
+
+    def iter_snapshots(
+        self,
+        snapshots: VideoSnapshotTaskResult | list[str],
+        *,
+        max_workers: int = 8,
+        max_retries: int = 3,
+    ) -> AsyncBatchIter[bytes]:
+        """Yield the content of the frames of a `video_snapshot` task. See `YiDong.iter_snapshots`."""
+
+        async def read(i: int, r: Resource) -> bytes:
+            f = io.BytesIO()
+            await self._download(
+                DownloadState(r.url, f), max_retries, DOWNLOAD_CHUNK_SIZE
+            )
+            return f.getvalue()
+
+        return self._snapshot_batch(snapshots, read, max_workers)
+
+    async def stack_snapshots(
+        self,
+        snapshots: VideoSnapshotTaskResult | list[str],
+        *,
+        mode: str = "RGB",
+        max_workers: int = 8,
+        max_retries: int = 3,
+    ) -> Any:
+        """Fetch and decode the frames of a `video_snapshot` task into a single
+        NumPy array. See `YiDong.stack_snapshots`."""
+        import numpy as np
+
+        n = len(snapshot_ids(snapshots))
+        frames = self.iter_snapshots(
+            snapshots, max_workers=max_workers, max_retries=max_retries
+        )
+        batch = None
+        i = 0
+        async for content in frames:
+            # decoding is CPU bound, keep it off the event loop
+            frame = await asyncio.to_thread(decode_image, content, mode)
+            if batch is None:
+                batch = np.empty((n, *frame.shape), frame.dtype)
+            batch[i] = frame
+            i += 1
+        if frames.errors:
+            raise next(iter(frames.errors.values()))
+        return batch if batch is not None else np.empty((0, 0, 0, len(mode)))
+
+    async def delete_resource(self, id: str) -> None:
+        await self._request(bool, "delete", f"/resource/{id}")
+        if self._upload_index is not None:
+            self._upload_index.invalidate(self._scope, id)
+        if self._resource_cache is not None:
+            self._resource_cache.invalidate(self._scope, id)
+
+    #####
+    async def list_webhook(self) -> list[WebhookResponse]:
+        webhooks = await self._request(Pagination[WebhookResponse], "get", "/webhook")
+        return webhooks.list
+
+    async def add_webhook(self, url: str, secret: str) -> WebhookResponse:
+        return await self._request(
+            WebhookResponse, "post", "/webhook", payload={"url": url, "secret": secret}
+        )
+
+    async def enable_webhook(self, webhook_id: str) -> WebhookResponse:
+        return await self._request(
+            WebhookResponse,
+            "patch",
+            f"/webhook/{webhook_id}",
+            payload={"status": "active"},
+        )
+
+    async def disable_webhook(self, webhook_id: str) -> WebhookResponse:
+        return await self._request(
+            WebhookResponse,
+            "patch",
+            f"/webhook/{webhook_id}",
+            payload={"status": "inactive"},
+        )
+
+    async def update_webhook(
+        self, webhook_id: str, *, url: str | None = None, secret: str | None = None
+    ) -> WebhookResponse:
+        payload = {}
+        if url is not None:
+            payload["url"] = url
+        if secret is not None:
+            payload["secret"] = secret
+        return await self._request(
+            WebhookResponse, "patch", f"/webhook/{webhook_id}", payload=payload
+        )
+
+    #####
+
+    async def list_task(
+        self,
+        page: int = 1,
+        page_size: int = 10,
+        ids: list[str] | None = None,
+    ) -> Pagination[TaskContainer]:
+        if ids and page == 1 and len(ids) <= page_size and self._task_cache is not None:
+            cached = self._task_cache.get_many(self._scope, ids)
+            misses = [i for i in ids if i not in cached]
+            fetched = None
+            if misses:
+                fetched = await self._list_task(page, page_size, misses)
+            return merge_cached_tasks(ids, cached, fetched, page_size)
+        return await self._list_task(page, page_size, ids)
+
+    async def _list_task(
+        self, page: int, page_size: int, ids: list[str] | None
+    ) -> Pagination[TaskContainer]:
+        params = {"page": page, "page_size": page_size}
+        if ids:
+            params["ids"] = ids
+        res = await self._request(
+            Pagination[TaskContainer], "get", "/task", params=params
+        )
+        if self._task_cache is not None:
+            self._task_cache.put_many(self._scope, res.list)
+        if self._metrics is not None:
+            self._metrics.observe_tasks(res.list)
+        return res
+
+    def list_task_iter(
+        self,
+        page_size: int = 100,
+        prefetch: int = 4,
+        limit: int | None = None,
+        **kwargs,
+    ) -> AsyncPaginationIter[TaskContainer]:
+        """See `YiDong.list_task_iter`."""
+        return AsyncPaginationIter[TaskContainer](
+            lambda p: self.list_task(page=p, page_size=page_size, **kwargs),
+            prefetch=prefetch,
+            limit=limit,
+        )
+
+    async def _get_task(self, id: str) -> TaskContainer:
+        if self._task_cache is not None:
+            if t := self._task_cache.get(self._scope, id):
+                return t
+        if self._task_loader is not None:
+            return await self._task_loader.load(id)
+        return await self._fetch_task(id)
+
+    async def _fetch_task(self, id: str) -> TaskContainer:
+        t = await self._request(TaskContainer, "get", f"/task/{id}")
+        if self._task_cache is not None:
+            self._task_cache.put(self._scope, t)
+        if self._metrics is not None:
+            self._metrics.observe_tasks([t])
+        return t
+
+    async def _fetch_tasks(self, ids: list[str]) -> dict[str, TaskContainer]:
+        page = await self._list_task(1, len(ids), ids)
+        return {t.id: t for t in page.list}
+
+    async def get_task(
+        self,
+        id: str,
+        block: bool = True,
+        poll_interval: float | None = None,
+        timeout: float = 0,
+        poll_policy: PollPolicy | None = None,
+        on_progress: ProgressHandler | None = None,
+    ) -> TaskContainer:
+        """Get the task detail with the given task id. See `YiDong.get_task`."""
+        if not block:
+            return await self._get_task(id)
+
+        if poll_interval is not None:
+            poll_policy = PollPolicy.fixed(poll_interval)
+        start = datetime.now()
+        attempt = 0
+        last = None
+        while True:
+            t = await self._get_task(id)
+            if t.is_done():
+                return t
+            if t.records and t.records[-1] != last:
+                last = t.records[-1]
+                report_progress(t, on_progress)
+            elapsed = (datetime.now() - start).total_seconds()
+            if timeout > 0 and elapsed > timeout:
+                raise TimeoutError(
+                    f"failed to fetch task [{id}] result within {timeout} seconds"
+                )
+            poll_policy = poll_policy or default_poll_policy(t.task.type)
+            await asyncio.sleep(poll_policy.interval(attempt, elapsed, t))
+            attempt += 1
+
+    async def as_completed(
+        self,
+        tasks: Iterable[AsyncTaskRef | str],
+        poll_interval: float | None = None,
+        timeout: float = 0,
+        batch_size: int = 100,
+        poll_policy: PollPolicy | None = None,
+    ) -> AsyncIterator[TaskContainer]:
+        """Yield tasks in the order of completion. See `YiDong.as_completed`."""
+        pending = {}
+        for t in tasks:
+            if isinstance(t, AsyncTaskRef):
+                pending[t.tid] = t
+            else:
+                pending[t] = None
+        if poll_interval is not None:
+            poll_policy = PollPolicy.fixed(poll_interval)
+        poll_policy = poll_policy or PollPolicy()
+        start = datetime.now()
+        attempt = 0
+        while pending:
+            ids = list(pending)
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i : i + batch_size]
+                page = await self.list_task(page_size=len(batch), ids=batch)
+                found = {t.id: t for t in page.list}
+                for id in batch:
+                    # ids unknown to the server are left out of the list, so
+                    # look them up alone to raise the actual error
+                    t = found.get(id) or await self.get_task(id, block=False)
+                    if t.is_done():
+                        if ref := pending.pop(id):
+                            ref.t = t
+                        yield t
+            if not pending:
+                return
+            elapsed = (datetime.now() - start).total_seconds()
+            if timeout > 0 and elapsed > timeout:
+                raise TimeoutError(
+                    f"failed to fetch results of {len(pending)} tasks within {timeout} seconds"
+                )
+            await asyncio.sleep(poll_policy.interval(attempt, elapsed))
+            attempt += 1
+
+    async def wait_tasks(
+        self, tasks: Iterable[AsyncTaskRef | str], **kwargs
+    ) -> list[TaskContainer]:
+        """Wait for all tasks to finish and return them in the given order. See `as_completed`."""
+        tasks = list(tasks)
+        done = {t.id: t async for t in self.as_completed(tasks, **kwargs)}
+        return [done[t.tid if isinstance(t, AsyncTaskRef) else t] for t in tasks]
+
+    async def delete_task(self, tid: str) -> bool:
+        if self._task_cache is not None:
+            self._task_cache.invalidate(self._scope, tid)
+        return await self._request(bool, "delete", f"/task/{tid}")
+
+    async def _submit_task(self, task_type: str, payload: dict) -> AsyncTaskRef:
+        task_cls, _ = TASK_REGISTRY[task_type]
+        task = task_cls.model_validate(payload)
+        key = None
+        if self._task_memo is not None:
+            key = task_key(task)
+            if not FORCE_RERUN.get():
+                if ref := await self._get_memoized(task_type, key):
+                    return ref
+        # the same key is sent on retries so the server creates the task only once
+        res = await self._request(
+            TaskInfo,
+            "post",
+            "/task",
+            content=task.model_dump_json(),
+            headers={
+                "Content-Type": "application/json",
+                "Idempotency-Key": uuid.uuid4().hex,
+            },
+            idempotent=True,
+        )
+        if key is not None:
+            self._task_memo.put(self._scope, key, res.id)
+        return _TASK_REFS[task_type](self, res.id)
+
+    async def _get_memoized(self, task_type: str, key: str) -> AsyncTaskRef | None:
+        if tid := self._task_memo.get(self._scope, key):
+            try:
+                t = await self._get_task(tid)
+            except (YDUnknownError, YDInternalServerError):
+                # the task is gone on the server side
+                t = None
+            if t is not None and is_reusable(t):
+                ref = _TASK_REFS[task_type](self, tid)
+                ref.t = t
+                return ref
+            self._task_memo.invalidate(self._scope, key)
+        return None
+
+    async def image_generation(
+        self,
+        prompt: str = "",
+        image_id: str = "",
+        config: DiffusionConfig = DiffusionConfig(),
+    ) -> AsyncTaskRef[ImageGenerationTask, ImageGenerationTaskResult]:
+        """Generate images based on the given prompt or the reference image."""
+        return await self._submit_task("image_generation", locals())
+
+    async def image_inpaint(
+        self,
+        image_id: str,
+        mask_base64: str = "",
+        prompt: str | None = None,
+        *,
+        mask: MaskLike | None = None,
+    ) -> AsyncTaskRef[ImageInpaintTask, ImageInpaintTaskResult]:
+        """Image inpaint based on the mask image and the given prompt, see
+        `YiDong.image_inpaint`."""
+        mask_base64 = resolve_mask(mask_base64, mask)
+        return await self._submit_task("image_inpaint", locals())
+
+    async def image_remove(
+        self,
+        image_id: str,
+        mask_base64: str = "",
+        *,
+        mask: MaskLike | None = None,
+    ) -> AsyncTaskRef[ImageRemoveTask, ImageRemoveTaskResult]:
+        """Image remove based on the mask image, see `YiDong.image_remove`."""
+        mask_base64 = resolve_mask(mask_base64, mask)
+        return await self._submit_task("image_remove", locals())
+
+    async def ping(self) -> AsyncTaskRef[PingTask, PingTaskResult]:
+        """A simple task to test the health of the server."""
+        return await self._submit_task("ping", locals())
+
+    async def video_concat(
+        self, video_ids: list[str], chapters: list[Chapter] = []
+    ) -> AsyncTaskRef[VideoConcatTask, VideoConcatTaskResult]:
+        """Concatenate multiple videos into one. See `YiDong.video_concat`."""
+        return await self._submit_task("video_concat", locals())
+
+    async def video_mashup(
+        self,
+        video_ids: list[str],
+        voice_overs: list[str],
+        bgm_id: str,
+        voice_style_id: str,
+        voice_style_text: str,
+        chapters: list[Chapter] | None = None,
+        lang: str = "en",
+        editor_config: EditorConfig | None = None,
+    ) -> AsyncTaskRef[VideoMashupTask, VideoMashupTaskResult]:
+        """Create a new video based on the given videos and other elements. See `YiDong.video_mashup`."""
+        return await self._submit_task("video_mashup", locals())
+
+    async def video_generation(
+        self,
+        prompt: str | None = None,
+        image_id: str = "",
+    ) -> AsyncTaskRef[VideoGenerationTask, VideoGenerationTaskResult]:
+        """Generate video based on the given prompt and the reference image."""
+        return await self._submit_task("video_generation", locals())
+
+    async def video_script(
+        self,
+        collection: list[VideoScriptTaskElement],
+        remix_s1_prompt: str,
+        remix_s2_prompt: str,
+        references: list[list[VideoScriptTaskResultElement]],
+        lang: str = "en",
+    ) -> AsyncTaskRef[VideoScriptTask, VideoScriptTaskResult]:
+        """Generate scripts based on a collection of video summarizations."""
+        return await self._submit_task("video_script", locals())
+
+    async def video_snapshot(
+        self, video_id: str, *, start: float = 0.0, step: int = 1, stop: float = 0.0
+    ) -> AsyncTaskRef[VideoSnapshotTask, VideoSnapshotTaskResult]:
+        """Take snapshots of the video at the given timestamps. See `YiDong.video_snapshot`."""
+        return await self._submit_task("video_snapshot", locals())
+
+    async def video_summary(
+        self,
+        video_id: str,
+        prompt: str | None = None,
+        chapter_prompt: str | None = None,
+        chapters: list[Chapter] | None = None,
+        display_lang: str = "en",
+    ) -> AsyncTaskRef[VideoSummaryTask, VideoSummaryTaskResult]:
+        """Summarize a video with the given video id. See `YiDong.video_summary`."""
+        return await self._submit_task("video_summary", locals())
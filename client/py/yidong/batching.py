@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Generic, Hashable, Mapping, TypeVar
+
+from yidong.util import LOOKUP_PAGE_SIZE
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class BatchLoader(Generic[K, V]):
+    """Coalesce lookups of single keys made by many threads at about the same
+    time into one lookup of many keys, in the manner of DataLoader.
+
+    The first `load` of a batch waits `window` seconds for others to join it,
+    or less if `max_batch` keys are gathered before. The batch is then
+    resolved with one call of `load_many`. Keys missing from its result are
+    resolved one by one with `load_one`, so that e.g. the proper not found
+    error is raised. Loading a key which is already pending or in flight
+    waits for the same result instead of fetching it again.
+
+    Args:
+        load_many: Fetch the values of many keys at once.
+        load_one: Fetch the value of a single key.
+        window: How many seconds to gather keys for.
+        max_batch: The most keys resolved by one `load_many` call.
+    """
+
+    def __init__(
+        self,
+        load_many: Callable[[list[K]], Mapping[K, V]],
+        load_one: Callable[[K], V],
+        window: float = 0.005,
+        max_batch: int = LOOKUP_PAGE_SIZE,
+    ) -> None:
+        self.load_many = load_many
+        self.load_one = load_one
+        self.window = window
+        self.max_batch = max_batch
+
+        self._lock = threading.Lock()
+        self._batch: dict[K, Future] | None = None
+        self._in_flight: dict[K, Future] = {}
+
+    def load(self, key: K) -> V:
+        leader = False
+        dispatch = None
+        with self._lock:
+            fut = self._in_flight.get(key)
+            if fut is None:
+                fut = self._in_flight[key] = Future()
+                if self._batch is None:
+                    self._batch = {}
+                    leader = True
+                batch = self._batch
+                batch[key] = fut
+                if len(batch) >= self.max_batch:
+                    self._batch = None
+                    dispatch = batch
+        if leader and dispatch is None:
+            time.sleep(self.window)
+            with self._lock:
+                # unless it has been filled up and sent by another thread
+                if self._batch is batch:
+                    self._batch = None
+                    dispatch = batch
+        if dispatch is not None:
+            self._dispatch(dispatch)
+        return fut.result()
+
+    def _dispatch(self, batch: dict[K, Future]) -> None:
+        try:
+            try:
+                values, error = self.load_many(list(batch)), None
+            except Exception as e:
+                values, error = {}, e
+            for key, fut in batch.items():
+                if key in values:
+                    fut.set_result(values[key])
+                elif error is not None:
+                    fut.set_exception(error)
+                else:
+                    try:
+                        fut.set_result(self.load_one(key))
+                    except Exception as e:
+                        fut.set_exception(e)
+        finally:
+            with self._lock:
+                for key, fut in batch.items():
+                    fut.cancel()
+                    del self._in_flight[key]
+
+
+class AsyncBatchLoader(Generic[K, V]):
+    """The asyncio counterpart of `BatchLoader`, coalescing the lookups of
+    coroutines running on the same event loop."""
+
+    def __init__(
+        self,
+        load_many: Callable[[list[K]], Awaitable[Mapping[K, V]]],
+        load_one: Callable[[K], Awaitable[V]],
+        window: float = 0.005,
+        max_batch: int = LOOKUP_PAGE_SIZE,
+    ) -> None:
+        self.load_many = load_many
+        self.load_one = load_one
+        self.window = window
+        self.max_batch = max_batch
+
+        self._batch: dict[K, asyncio.Future] | None = None
+        self._in_flight: dict[K, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load(self, key: K) -> V:
+        fut = self._in_flight.get(key)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = self._in_flight[key] = loop.create_future()
+            if self._batch is None:
+                self._batch = {}
+                loop.call_later(self.window, self._flush, self._batch)
+            self._batch[key] = fut
+            if len(self._batch) >= self.max_batch:
+                self._flush(self._batch)
+        # a cancelled caller must not cancel the lookup shared with others
+        return await asyncio.shield(fut)
+
+    def _flush(self, batch: dict[K, asyncio.Future]) -> None:
+        if self._batch is not batch:
+            return
+        self._batch = None
+        task = asyncio.ensure_future(self._dispatch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: dict[K, asyncio.Future]) -> None:
+        try:
+            try:
+                values, error = await self.load_many(list(batch)), None
+            except Exception as e:
+                values, error = {}, e
+            for key, fut in batch.items():
+                if key in values:
+                    fut.set_result(values[key])
+                elif error is not None:
+                    fut.set_exception(error)
+                else:
+                    try:
+                        fut.set_result(await self.load_one(key))
+                    except Exception as e:
+                        fut.set_exception(e)
+        finally:
+            for key, fut in batch.items():
+                fut.cancel()
+                del self._in_flight[key]
@@ -0,0 +1,380 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterator
+from urllib.parse import parse_qsl, urlsplit
+
+from pydantic import BaseModel
+from yidong.config import CONFIG
+from yidong.model import Pagination, Resource, TaskContainer, TaskRecordType
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+FORCE_RERUN: ContextVar[bool] = ContextVar("yidong_force_rerun", default=False)
+
+# sqlite limits the number of variables in one statement
+MAX_SQL_VARIABLES = 500
+
+# cached resources are refreshed this many seconds before their url expires,
+# so that a download started from the cache has time to complete
+URL_EXPIRY_MARGIN = 60
+
+
+def client_scope(base_url: str, api_key: str) -> str:
+    """Resource ids are only valid for the server and the account they were
+    created with, so cached entries are partitioned by this scope."""
+    return hashlib.sha256(f"{base_url}\0{api_key}".encode()).hexdigest()[:16]
+
+
+class UploadIndex:
+    """A local SQLite index from file content hashes to uploaded resource ids.
+
+    Hashing is skipped for files whose path, size and mtime are unchanged
+    since they were last hashed.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        path = path or os.path.join(
+            os.path.expanduser(CONFIG.cache_dir), "uploads.sqlite"
+        )
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS uploads "
+                "(scope TEXT, digest TEXT, rid TEXT, created_at REAL, "
+                "PRIMARY KEY (scope, digest))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS uploads_rid ON uploads (scope, rid)"
+            )
+
+    def digest(self, file: str) -> str:
+        """The sha256 hex digest of the file content."""
+        path = os.path.abspath(file)
+        st = os.stat(path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+        if row:
+            return row[0]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, digest),
+            )
+        return digest
+
+    def get(self, scope: str, digest: str) -> str | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT rid FROM uploads WHERE scope = ? AND digest = ?",
+                (scope, digest),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, scope: str, digest: str, rid: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)",
+                (scope, digest, rid, time.time()),
+            )
+
+    def invalidate(self, scope: str, rid: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM uploads WHERE scope = ? AND rid = ?", (scope, rid)
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class TaskCache:
+    """A local SQLite cache of finished tasks, which never change again.
+
+    Only tasks whose last record is `success` or `fail` are stored. Once the
+    stored tasks take more than `max_size` bytes, the least recently read
+    ones are evicted.
+    """
+
+    def __init__(self, path: str | None = None, max_size: int | None = None) -> None:
+        path = path or os.path.join(
+            os.path.expanduser(CONFIG.cache_dir), "tasks.sqlite"
+        )
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_size = CONFIG.task_cache_size if max_size is None else max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tasks "
+                "(scope TEXT, id TEXT, body BLOB, size INTEGER, accessed_at REAL, "
+                "PRIMARY KEY (scope, id))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_accessed ON tasks (accessed_at)"
+            )
+            self._size = self._total_size()
+
+    def _total_size(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM tasks").fetchone()[
+            0
+        ]
+
+    def get(self, scope: str, id: str) -> TaskContainer | None:
+        return self.get_many(scope, [id]).get(id)
+
+    def get_many(self, scope: str, ids: list[str]) -> dict[str, TaskContainer]:
+        rows = []
+        with self._lock, self._db:
+            for i in range(0, len(ids), MAX_SQL_VARIABLES):
+                batch = ids[i : i + MAX_SQL_VARIABLES]
+                marks = ",".join("?" * len(batch))
+                rows += self._db.execute(
+                    f"SELECT id, body FROM tasks WHERE scope = ? AND id IN ({marks})",
+                    (scope, *batch),
+                ).fetchall()
+                self._db.execute(
+                    f"UPDATE tasks SET accessed_at = ? WHERE scope = ? AND id IN ({marks})",
+                    (time.time(), scope, *batch),
+                )
+        return {id: TaskContainer.model_validate_json(body) for id, body in rows}
+
+    def put(self, scope: str, t: TaskContainer) -> None:
+        """Store the task if it is done, otherwise do nothing."""
+        self.put_many(scope, [t])
+
+    def put_many(self, scope: str, tasks: list[TaskContainer]) -> None:
+        rows = [
+            (scope, t.id, body, len(body), time.time())
+            for t in tasks
+            if t.is_done() and (body := t.model_dump_json().encode())
+        ]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._size += sum(r[3] for r in rows)
+            if self.max_size > 0 and self._size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        # other processes may share the file, so start from the actual size
+        self._size = self._total_size()
+        excess = self._size - self.max_size
+        if excess <= 0:
+            return
+        cutoff = None
+        for accessed_at, size in self._db.execute(
+            "SELECT accessed_at, size FROM tasks ORDER BY accessed_at"
+        ):
+            excess -= size
+            if excess <= 0:
+                cutoff = accessed_at
+                break
+        self._db.execute("DELETE FROM tasks WHERE accessed_at <= ?", (cutoff,))
+        self._size = self._total_size()
+
+    def invalidate(self, scope: str, id: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM tasks WHERE scope = ? AND id = ?", (scope, id)
+            )
+            self._size = self._total_size()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def merge_cached_tasks(
+    ids: list[str],
+    cached: dict[str, TaskContainer],
+    fetched: Pagination[TaskContainer] | None,
+    page_size: int,
+) -> Pagination[TaskContainer]:
+    """Combine cache hits with the page fetched for the misses, in the order of `ids`."""
+    found = dict(cached)
+    if fetched is not None:
+        found.update((t.id, t) for t in fetched.list)
+    return Pagination[TaskContainer](
+        page=1,
+        page_size=page_size,
+        total=len(cached) + (fetched.total if fetched is not None else 0),
+        list=[found[i] for i in ids if i in found],
+    )
+
+
+def task_key(task: BaseModel) -> str:
+    """The sha256 hex digest of a validated task, with defaults filled in and keys sorted."""
+    body = json.dumps(
+        task.model_dump(mode="json"), sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def is_reusable(t: TaskContainer) -> bool:
+    """Whether a memoized task can stand in for a new one, i.e. it has not failed."""
+    return not t.records or t.records[-1].type != TaskRecordType.fail
+
+
+@contextmanager
+def force_rerun() -> Iterator[None]:
+    """Submit new tasks inside the block even if an identical task is memoized.
+
+    Example:
+
+        with force_rerun():
+            t = yd.video_summary(video_id)
+    """
+    token = FORCE_RERUN.set(True)
+    try:
+        yield
+    finally:
+        FORCE_RERUN.reset(token)
+
+
+class TaskMemo:
+    """A local SQLite index from the content of submitted tasks to their ids.
+
+    Entries older than `ttl` seconds are ignored, 0 means they never expire.
+    """
+
+    def __init__(self, path: str | None = None, ttl: float | None = None) -> None:
+        path = path or os.path.join(os.path.expanduser(CONFIG.cache_dir), "memo.sqlite")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl = CONFIG.task_memo_ttl if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS memo "
+                "(scope TEXT, key TEXT, tid TEXT, created_at REAL, "
+                "PRIMARY KEY (scope, key))"
+            )
+
+    def get(self, scope: str, key: str) -> str | None:
+        since = time.time() - self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            row = self._db.execute(
+                "SELECT tid FROM memo WHERE scope = ? AND key = ? AND created_at >= ?",
+                (scope, key, since),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, scope: str, key: str, tid: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?)",
+                (scope, key, tid, time.time()),
+            )
+
+    def invalidate(self, scope: str, key: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM memo WHERE scope = ? AND key = ?", (scope, key)
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def url_expires_at(url: str) -> float | None:
+    """The unix time at which a pre-signed url expires, if it can be told from
+    its query string: S3 (both signature versions), GCS and OSS styles."""
+    query = {k.lower(): v for k, v in parse_qsl(urlsplit(url).query)}
+    for prefix in ("x-amz-", "x-goog-", "x-oss-"):
+        date, expires = query.get(f"{prefix}date"), query.get(f"{prefix}expires")
+        if date and expires and expires.isdigit():
+            try:
+                signed_at = datetime.strptime(date, "%Y%m%dT%H%M%SZ")
+            except ValueError:
+                return None
+            return signed_at.replace(tzinfo=timezone.utc).timestamp() + int(expires)
+    expires = query.get("expires")
+    return float(expires) if expires and expires.isdigit() else None
+
+
+class ResourceCache:
+    """An in-process LRU cache of resource metadata.
+
+    An entry is dropped `ttl` seconds after it is stored, or earlier if the
+    pre-signed `url` of the resource is about to expire. Once more than
+    `max_size` resources are stored, the least recently read ones are evicted.
+    """
+
+    def __init__(self, max_size: int | None = None, ttl: float | None = None) -> None:
+        self.max_size = CONFIG.resource_cache_size if max_size is None else max_size
+        self.ttl = CONFIG.resource_cache_ttl if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[
+            tuple[str, str], tuple[Resource, float]
+        ] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, scope: str, id: str) -> Resource | None:
+        key = (scope, id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, scope: str, r: Resource) -> None:
+        self.put_many(scope, [r])
+
+    def put_many(self, scope: str, resources: list[Resource]) -> None:
+        now = time.time()
+        with self._lock:
+            for r in resources:
+                if not r.uploaded_at:
+                    continue
+                expires_at = now + self.ttl if self.ttl > 0 else float("inf")
+                if (url_expiry := url_expires_at(r.url)) is not None:
+                    expires_at = min(expires_at, url_expiry - URL_EXPIRY_MARGIN)
+                if expires_at <= now:
+                    self._entries.pop((scope, r.id), None)
+                    continue
+                self._entries[(scope, r.id)] = (r, expires_at)
+                self._entries.move_to_end((scope, r.id))
+            while len(self._entries) > self.max_size > 0:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, scope: str, id: str) -> None:
+        with self._lock:
+            self._entries.pop((scope, id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -1,23 +1,42 @@
-import inspect
+import io
+import logging
 import mimetypes
 import os
+import sys
+import uuid
+from contextlib import nullcontext
 from datetime import datetime
-from time import sleep
-from typing import Any, Iterable, get_args
+from functools import wraps
+from time import sleep, time
+from types import GeneratorType
+from typing import Any, BinaryIO, Callable, Iterable, Iterator
 from urllib.parse import urlparse
 
 import httpx
-import rich
-from jsonargparse import CLI
-from pydantic import TypeAdapter, ValidationError
-from yidong.config import CONFIG
+from yidong.batching import BatchLoader
+from yidong.cache import (
+    FORCE_RERUN,
+    ResourceCache,
+    TaskCache,
+    TaskMemo,
+    UploadIndex,
+    client_scope,
+    is_reusable,
+    merge_cached_tasks,
+    task_key,
+)
+from yidong.config import CONFIG, HTTPConfig
 from yidong.exception import (
+    YDDownloadError,
     YDError,
     YDInternalServerError,
-    YDInvalidReplyError,
-    convert_reply_to_error,
+    YDResourceNotUploadedError,
+    YDUnknownError,
+    YDUploadError,
 )
+from yidong.metrics import STORAGE, Metrics, endpoint, error_code
 from yidong.model import (
+    TASK_REGISTRY,
     Chapter,
     DiffusionConfig,
     EditorConfig,
@@ -30,11 +49,9 @@ from yidong.model import (
     Pagination,
     PingTask,
     PingTaskResult,
-    Reply,
     Resource,
     ResourceUploadResponse,
     T,
-    Task,
     TaskContainer,
     TaskInfo,
     VideoConcatTask,
@@ -53,24 +70,181 @@ from yidong.model import (
     VideoSummaryTaskResult,
     WebhookResponse,
 )
-from yidong.util import PaginationIter, ResourceRef, TaskRef
+from yidong.polling import (
+    PollPolicy,
+    ProgressHandler,
+    default_poll_policy,
+    report_progress,
+)
+from yidong.ratelimit import RateLimiter, default_rate_limiter
+from yidong.retry import IDEMPOTENT_METHODS, RetryHook, RetryPolicy, notify_retry
+from yidong.util import (
+    DOWNLOAD_CHUNK_SIZE,
+    LOOKUP_PAGE_SIZE,
+    RESOURCE_SOURCES,
+    UPLOAD_CHUNK_SIZE,
+    BatchIter,
+    DownloadState,
+    MaskLike,
+    PaginationIter,
+    ProgressCallback,
+    ResourceRef,
+    TaskRef,
+    check_upload_response,
+    decode_image,
+    decode_reply,
+    expand_paths,
+    iter_file,
+    resolve_mask,
+    resource_file_name,
+    snapshot_ids,
+)
+
+_TASK_REFS = {k: TaskRef[t, r] for k, (t, r) in TASK_REGISTRY.items()}
 
 
 class YiDong:
     _client: httpx.Client
 
     def __init__(
-        self, api_key: str = CONFIG.api_key, base_url: str = CONFIG.base_url
+        self,
+        api_key: str = CONFIG.api_key,
+        base_url: str = CONFIG.base_url,
+        upload_index: UploadIndex | None = None,
+        retry_policy: RetryPolicy | None = None,
+        on_retry: RetryHook | None = None,
+        rate_limiter: RateLimiter | None = None,
+        http_config: HTTPConfig | None = None,
+        storage_http_config: HTTPConfig | None = None,
+        task_cache: TaskCache | None = None,
+        task_memo: TaskMemo | None = None,
+        metrics: Metrics | None = None,
+        resource_cache: ResourceCache | None = None,
+        coalesce_window: float | None = None,
     ) -> None:
         """Initialize the Client
 
         Args:
             base_url: The base url of the server.
             api_key: The api key for authentication.
+            upload_index: If provided, local files whose content has been
+                uploaded before are not uploaded again and the existing
+                resource is returned instead. By default an index under
+                `CONFIG.cache_dir` is used if `CONFIG.upload_dedup` is set.
+            retry_policy: When to retry failed API requests. By default up to
+                `CONFIG.max_retries` retries are made.
+            on_retry: Called with a `RetryEvent` before each retry.
+            rate_limiter: Every API request, upload and download passes
+                through it. Share one limiter between clients to stay under a
+                common limit. By default the process wide limiter configured
+                by `CONFIG.rate_limit` and `CONFIG.max_in_flight` is used.
+            http_config: Connection pool, HTTP/2 and timeout settings of API
+                requests. Defaults to `CONFIG.http`.
+            storage_http_config: The same settings for uploads and downloads
+                of resource files, which usually need much longer read and
+                write timeouts. Defaults to `CONFIG.storage_http`.
+            task_cache: If provided, finished tasks are stored locally and
+                `get_task`, `TaskRef` and `list_task(ids=...)` only fetch the
+                tasks which are not cached yet. By default a cache under
+                `CONFIG.cache_dir` is used if `CONFIG.task_cache` is set.
+            task_memo: If provided, submitting a task identical to one
+                submitted within `task_memo.ttl` seconds returns the existing
+                task instead, unless it has failed or the call is made inside
+                `yidong.cache.force_rerun()`. By default a memo under
+                `CONFIG.cache_dir` is used if `CONFIG.task_memo` is set.
+            metrics: If provided, the latency, bytes and status of requests,
+                uploads and downloads, retries, errors and the queued and
+                running time of finished tasks are recorded into it.
+            resource_cache: If provided, `get_resource` serves resources
+                looked up recently from memory until they expire or are
+                updated or deleted through this client. By default one is
+                created if `CONFIG.resource_cache` is set.
+            coalesce_window: If greater than 0, `get_resource` and `get_task`
+                calls made within this many seconds of each other are
+                resolved together by one `list_resource(ids=...)` or
+                `list_task(ids=...)` request, and concurrent calls with the
+                same id share one request. Defaults to `CONFIG.coalesce_window`.
         """
+        self._rate_limiter = rate_limiter or default_rate_limiter() or nullcontext()
+        self._retry_policy = retry_policy or RetryPolicy(max_retries=CONFIG.max_retries)
+        self._on_retry = on_retry
+        if upload_index is None and CONFIG.upload_dedup:
+            upload_index = UploadIndex()
+        self._upload_index = upload_index
+        if task_cache is None and CONFIG.task_cache:
+            task_cache = TaskCache()
+        self._task_cache = task_cache
+        if task_memo is None and CONFIG.task_memo:
+            task_memo = TaskMemo()
+        self._task_memo = task_memo
+        self._metrics = metrics
+        if resource_cache is None and CONFIG.resource_cache:
+            resource_cache = ResourceCache()
+        self._resource_cache = resource_cache
+        self._scope = client_scope(base_url, api_key)
+        if coalesce_window is None:
+            coalesce_window = CONFIG.coalesce_window
+        self._resource_loader = self._task_loader = None
+        if coalesce_window > 0:
+            self._resource_loader = BatchLoader[str, Resource](
+                self._fetch_resources, self._fetch_resource, coalesce_window
+            )
+            self._task_loader = BatchLoader[str, TaskContainer](
+                self._fetch_tasks, self._fetch_task, coalesce_window
+            )
+        http_config = http_config or CONFIG.http
+        storage_http_config = storage_http_config or CONFIG.storage_http
         self._client = httpx.Client(
-            base_url=base_url, headers={CONFIG.api_key_header: api_key}
+            base_url=base_url,
+            headers={CONFIG.api_key_header: api_key},
+            **http_config.client_kwargs(),
         )
+        # pre-signed storage urls must not receive the api key
+        self._storage_client = httpx.Client(
+            follow_redirects=True, **storage_http_config.client_kwargs()
+        )
+
+    def __enter__(self) -> "YiDong":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._client.close()
+        self._storage_client.close()
+
+    def _send(
+        self, method: str, path: str, *, idempotent: bool | None = None, **kwargs
+    ) -> httpx.Response:
+        """Send a request to the API server, retrying according to the retry policy."""
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        metrics = self._metrics
+        label = endpoint(method, path) if metrics is not None else None
+        attempt = 0
+        while True:
+            resp = error = None
+            try:
+                with self._rate_limiter:
+                    start = time()
+                    resp = self._client.request(method, path, **kwargs)
+                if metrics is not None:
+                    metrics.observe(label, start, resp, received=len(resp.content))
+                if not self._retry_policy.should_retry(attempt, idempotent, resp):
+                    return resp
+            except httpx.TransportError as e:
+                if metrics is not None:
+                    metrics.observe(label, start, error=e)
+                if not self._retry_policy.should_retry(attempt, idempotent, error=e):
+                    raise
+                error = e
+            if metrics is not None:
+                metrics.on_retry(label)
+            delay = self._retry_policy.delay(attempt, resp)
+            notify_retry(self._on_retry, method, path, attempt, delay, resp, error)
+            sleep(delay)
+            attempt += 1
 
     def _request(
         self,
@@ -82,31 +256,38 @@ class YiDong:
         payload: dict | None = None,
         headers: dict | None = None,
         content: str | bytes | Iterable[bytes] | None = None,
+        idempotent: bool | None = None,
     ) -> T:
         try:
-            resp = self._client.request(
-                method=method,
-                url=path,
+            resp = self._send(
+                method,
+                path,
+                idempotent=idempotent,
                 params=params,
                 json=payload,
                 headers=headers,
                 content=content,
             )
             resp.raise_for_status()
-            reply = Reply[T].parse_raw(resp.content)
+            return decode_reply(T, resp.content)
         except httpx.HTTPStatusError as e:
-            raise YDInternalServerError(e.response.status_code, e.response.text)
-        except ValidationError:
-            try:
-                reply = Reply[Any].parse_raw(resp.content)
-                raise convert_reply_to_error(reply)
-            except ValidationError:
-                raise YDInvalidReplyError(resp.content)
-
-        return reply.data
+            error = YDInternalServerError(e.response.status_code, e.response.text)
+            if self._metrics is not None:
+                self._metrics.on_error(endpoint(method, path), error.status_code)
+            raise error
+        except YDError as e:
+            if self._metrics is not None:
+                self._metrics.on_error(endpoint(method, path), error_code(e))
+            raise
 
     def add_resource(
-        self, file: str | None = None, content_type: str | None = None
+        self,
+        file: str | None = None,
+        content_type: str | None = None,
+        *,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        max_retries: int = 3,
+        progress: ProgressCallback | None = None,
     ) -> Resource | ResourceRef:
         """Add a resource to the server. A resource id will be returned.
 
@@ -124,9 +305,16 @@ class YiDong:
                 extension. If it fails, it will be set to
                 `application/octet-stream` by default. You can still update it
                 later with the `update_resource` method.
+            chunk_size: The number of bytes read from a local file at a time.
+                The file is streamed and never loaded into memory as a whole.
+            max_retries: How many times to retry the upload of a local file
+                after a network error or a server side error.
+            progress: A callback receiving `(bytes_sent, total_bytes)` while
+                a local file is being uploaded.
         """
         if file is None:
-            r = self._client.put(
+            r = self._send(
+                "put",
                 f"/resource",
                 headers={"Content-Type": content_type or "application/octet-stream"},
             )
@@ -139,12 +327,18 @@ class YiDong:
             else:
                 raise YDError(1, "Failed to get pre-signed url", r.text)
         elif os.path.exists(file):
+            digest = None
+            if self._upload_index is not None:
+                digest = self._upload_index.digest(file)
+                if res := self._get_uploaded(digest):
+                    return res
             headers = {
                 "Content-Type": content_type
                 or mimetypes.guess_type(file)[0]
                 or "application/octet-stream"
             }
-            r = self._client.put(
+            r = self._send(
+                "put",
                 f"/resource",
                 headers=headers,
                 params={"file": file},
@@ -152,13 +346,11 @@ class YiDong:
             if r.status_code == 307:
                 rid = r.headers["x-yds-resource-id"]
                 url = r.headers["Location"]
-                with open(file, "rb") as f:
-                    r = self._client.put(
-                        url,
-                        content=f,
-                        headers=headers,
-                    )
-                return self.get_resource(rid)
+                self._upload(url, file, headers, chunk_size, max_retries, progress)
+                res = self.get_resource(rid)
+                if digest:
+                    self._upload_index.put(self._scope, digest, rid)
+                return res
             else:
                 raise YDError(1, "Failed to get pre-signed url", r.text)
         else:
@@ -171,6 +363,97 @@ class YiDong:
             else:
                 raise FileNotFoundError(f"File not found: {file}")
 
+    def add_resources(
+        self,
+        files: str | list[str],
+        content_type: str | None = None,
+        *,
+        max_workers: int = 8,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        max_retries: int = 3,
+    ) -> BatchIter[Resource | ResourceRef]:
+        """Add many resources concurrently. Each resource is yielded as soon as
+        it is uploaded, not necessarily in the order of `files`.
+
+        Failures do not abort the batch. They are collected in the `errors`
+        attribute of the returned iterator, keyed by the file path.
+
+        Args:
+            files: File paths, directories or glob patterns like
+                `clips/**/*.mp4`. Directories are walked recursively.
+            content_type: The mime content type of all files. See `add_resource`.
+            max_workers: The number of files being uploaded at the same time.
+            chunk_size: See `add_resource`.
+            max_retries: See `add_resource`.
+        """
+        return BatchIter[Resource | ResourceRef](
+            lambda f: self.add_resource(
+                f, content_type, chunk_size=chunk_size, max_retries=max_retries
+            ),
+            expand_paths(files),
+            max_workers,
+        )
+
+    def _get_uploaded(self, digest: str) -> Resource | None:
+        if rid := self._upload_index.get(self._scope, digest):
+            try:
+                return self.get_resource(rid)
+            except (
+                YDUnknownError,
+                YDInternalServerError,
+                YDResourceNotUploadedError,
+            ):
+                # the resource is gone or broken on the server side
+                self._upload_index.invalidate(self._scope, rid)
+        return None
+
+    def _upload(
+        self,
+        url: str,
+        file: str,
+        headers: dict,
+        chunk_size: int,
+        max_retries: int,
+        progress: ProgressCallback | None,
+    ) -> None:
+        # pre-signed urls do not accept chunked transfer encoding
+        headers = headers | {"Content-Length": str(os.path.getsize(file))}
+        metrics = self._metrics
+        retries = 0
+        while True:
+            r = error = None
+            try:
+                with self._rate_limiter:
+                    start = time()
+                    r = self._storage_client.put(
+                        url,
+                        content=iter_file(file, chunk_size, progress),
+                        headers=headers,
+                    )
+                if metrics is not None:
+                    metrics.observe(f"PUT {STORAGE}", start, r)
+                if check_upload_response(url, r, retries < max_retries):
+                    return
+            except httpx.TransportError as e:
+                if metrics is not None:
+                    metrics.observe(f"PUT {STORAGE}", start, error=e)
+                if retries >= max_retries:
+                    raise YDUploadError(url, str(e)) from e
+                error = e
+            except YDUploadError:
+                if metrics is not None:
+                    metrics.on_error(f"PUT {STORAGE}", r.status_code)
+                raise
+            if metrics is not None:
+                metrics.on_retry(f"PUT {STORAGE}")
+            # honours `Retry-After` of the storage service
+            delay = self._retry_policy.delay(retries, r)
+            notify_retry(
+                self._on_retry, "PUT", url.partition("?")[0], retries, delay, r, error
+            )
+            sleep(delay)
+            retries += 1
+
     def update_resource(
         self, id: str, name: str | None = None, mime: str | None = None
     ) -> Resource:
@@ -181,9 +464,12 @@ class YiDong:
             name: The file name of the resource.
             mime: The mime content type of the resource.
         """
-        return self._request(
+        r = self._request(
             Resource, "patch", f"/resource/{id}", payload={"name": name, "mime": mime}
         )
+        if self._resource_cache is not None:
+            self._resource_cache.put(self._scope, r)
+        return r
 
     def list_resource(
         self,
@@ -202,29 +488,312 @@ class YiDong:
         params = {"page": page, "page_size": page_size, "source": source}
         if ids:
             params["ids"] = ids
-        return self._request(
+        res = self._request(
             Pagination[Resource],
             "get",
             "/resource",
             params=params,
         )
+        if self._resource_cache is not None:
+            self._resource_cache.put_many(self._scope, res.list)
+        return res
+
+    def list_resource_iter(
+        self,
+        page_size: int = 100,
+        prefetch: int = 4,
+        limit: int | None = None,
+        **kwargs,
+    ) -> PaginationIter[Resource]:
+        """Iterate over all resources matching the filters of `list_resource`, fetching up to `prefetch` pages ahead concurrently.
 
-    def list_resource_iter(self, **kwargs) -> PaginationIter[Resource]:
-        return PaginationIter[Resource](lambda p: self.list_resource(page=p, **kwargs))
+        Args:
+            page_size: The number of resources per request.
+            prefetch: The number of pages fetched ahead. 0 fetches one page at a time.
+            limit: Stop after this many resources.
+        """
+        return PaginationIter[Resource](
+            lambda p: self.list_resource(page=p, page_size=page_size, **kwargs),
+            prefetch=prefetch,
+            limit=limit,
+        )
 
     def get_resource(self, id: str) -> Resource:
-        return self._request(Resource, "get", f"/resource/{id}")
-
-    def download_resource(self, id: str, path: str | None = None) -> str:
-        r = self.get_resource(id)
-        path = path or r.name or f"{r.id}.{r.mime.split('/')[1]}"
-        with open(path, "wb") as f:
-            resp = httpx.get(r.url)
-            f.write(resp.content)
+        if self._resource_cache is not None:
+            if r := self._resource_cache.get(self._scope, id):
+                return r
+        if self._resource_loader is not None:
+            return self._resource_loader.load(id)
+        return self._fetch_resource(id)
+
+    def _fetch_resource(self, id: str) -> Resource:
+        r = self._request(Resource, "get", f"/resource/{id}")
+        if self._resource_cache is not None:
+            self._resource_cache.put(self._scope, r)
+        return r
+
+    def _fetch_resources(self, ids: list[str]) -> dict[str, Resource]:
+        page = self.list_resource(page_size=len(ids), source=RESOURCE_SOURCES, ids=ids)
+        # leave resources which are not uploaded to `get_resource`, which raises
+        return {r.id: r for r in page.list if r.uploaded_at}
+
+    def download_resource(
+        self,
+        id: str,
+        path: str | BinaryIO | None = None,
+        *,
+        resume: bool = True,
+        max_retries: int = 3,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        expected_size: int | None = None,
+        checksum: str | None = None,
+        checksum_algorithm: str = "sha256",
+    ) -> str | BinaryIO:
+        """Download the resource with the given id.
+
+        The content is streamed in chunks of `chunk_size` bytes so memory usage
+        stays bounded regardless of the resource size.
+
+        Args:
+            id: The resource id.
+            path: A local file path or a writable binary file-like object. If
+                not provided, the resource name will be used as the file name.
+            resume: When downloading to a local path, the content is first
+                written to `{path}.{id}.part`. If such a file is left over by an
+                interrupted download, only the missing bytes will be fetched.
+            max_retries: How many times to resume after a network error.
+            chunk_size: The number of bytes to read and write each time.
+            expected_size: If provided, the downloaded size must match it.
+            checksum: If provided, the hex digest of the downloaded content must
+                match it.
+            checksum_algorithm: The `hashlib` algorithm used for `checksum`.
+        """
+        download = lambda r: self._download_resource(
+            r,
+            path,
+            resume,
+            max_retries,
+            chunk_size,
+            expected_size,
+            checksum,
+            checksum_algorithm,
+        )
+        try:
+            return download(self.get_resource(id))
+        except YDDownloadError as e:
+            if self._resource_cache is None or e.status_code not in (401, 403):
+                raise
+            # the url of the cached resource was revoked or expired early
+            self._resource_cache.invalidate(self._scope, id)
+            return download(self.get_resource(id))
+
+    def _download_resource(
+        self,
+        r: Resource,
+        path: str | BinaryIO | None,
+        resume: bool = True,
+        max_retries: int = 3,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        expected_size: int | None = None,
+        checksum: str | None = None,
+        checksum_algorithm: str = "sha256",
+    ) -> str | BinaryIO:
+        if path is not None and not isinstance(path, (str, os.PathLike)):
+            state = DownloadState(r.url, path, None, checksum, checksum_algorithm)
+            self._download(state, max_retries, chunk_size)
+            state.verify(expected_size)
+            return path
+
+        path = path or resource_file_name(r)
+        # keyed by the resource, so a leftover of another one is never resumed
+        part = f"{path}.{r.id}.part"
+        with open(part, "a+b" if resume else "w+b") as f:
+            state = DownloadState(r.url, f, 0, checksum, checksum_algorithm)
+            self._download(state, max_retries, chunk_size)
+            try:
+                state.verify(expected_size)
+            except YDDownloadError:
+                # do not resume from corrupted content next time
+                state.restart()
+                raise
+        os.replace(part, path)
         return path
 
+    def _download(
+        self, state: DownloadState, max_retries: int, chunk_size: int
+    ) -> None:
+        metrics = self._metrics
+        label = f"GET {STORAGE}"
+        retries = 0
+        while True:
+            start, received, resp = time(), state.received, None
+            try:
+                with self._rate_limiter, self._storage_client.stream(
+                    "GET", state.url, headers=state.headers()
+                ) as resp:
+                    if state.start(resp):
+                        for chunk in resp.iter_bytes(chunk_size):
+                            state.write(chunk)
+                if metrics is not None:
+                    metrics.observe(
+                        label, start, resp, received=state.received - received
+                    )
+                if state.is_complete():
+                    return
+                raise httpx.ReadError("incomplete body")
+            except httpx.HTTPStatusError as e:
+                resp, error = e.response, None
+                if metrics is not None:
+                    metrics.observe(label, start, resp)
+                status = resp.status_code
+                if retries >= max_retries or (status != 429 and status < 500):
+                    if metrics is not None:
+                        metrics.on_error(label, status)
+                    raise YDDownloadError(state.url, f"HTTP {status}", status)
+            except httpx.TransportError as e:
+                resp, error = None, e
+                if metrics is not None:
+                    metrics.observe(label, start, error=e)
+                if retries >= max_retries:
+                    raise YDDownloadError(state.url, str(e)) from e
+            if metrics is not None:
+                metrics.on_retry(label)
+            # honours `Retry-After` of the storage service
+            delay = self._retry_policy.delay(retries, resp)
+            notify_retry(
+                self._on_retry,
+                "GET",
+                state.url.partition("?")[0],
+                retries,
+                delay,
+                resp,
+                error,
+            )
+            sleep(delay)
+            retries += 1
+
+    def _snapshot_batch(
+        self,
+        snapshots: VideoSnapshotTaskResult | list[str],
+        fn: Callable[[int, Resource], T],
+        max_workers: int,
+    ) -> BatchIter[T]:
+        ids = snapshot_ids(snapshots)
+        index = {id: i for i, id in enumerate(ids)}
+        resources: dict[str, Resource] = {}
+
+        def items() -> Iterator[str]:
+            # look the frames up `LOOKUP_PAGE_SIZE` at a time instead of one
+            # `get_resource` each, just ahead of downloading them
+            for i in range(0, len(ids), LOOKUP_PAGE_SIZE):
+                chunk = ids[i : i + LOOKUP_PAGE_SIZE]
+                page = self.list_resource(
+                    page_size=len(chunk), source=RESOURCE_SOURCES, ids=chunk
+                )
+                resources.update((r.id, r) for r in page.list)
+                yield from chunk
+
+        return BatchIter[T](
+            lambda id: fn(index[id], resources.pop(id, None) or self.get_resource(id)),
+            items(),
+            max_workers,
+            ordered=True,
+        )
+
+    def download_snapshots(
+        self,
+        snapshots: VideoSnapshotTaskResult | list[str],
+        path: str = ".",
+        *,
+        max_workers: int = 8,
+        max_retries: int = 3,
+    ) -> BatchIter[str]:
+        """Download the frames of a `video_snapshot` task into a directory
+        concurrently, yielding the file paths in the order of the frames.
+
+        Files are named by the frame number, e.g. `000042.jpg`. Failures do not
+        abort the batch. They are collected in the `errors` attribute of the
+        returned iterator, keyed by the image id.
+
+        Args:
+            snapshots: The result of a `video_snapshot` task or its image ids.
+            path: The directory to save the frames in. It is created if needed.
+            max_workers: The number of frames being downloaded at the same time.
+            max_retries: See `download_resource`.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        def download(i: int, r: Resource) -> str:
+            ext = os.path.splitext(resource_file_name(r))[1]
+            return self._download_resource(
+                r, os.path.join(path, f"{i:06d}{ext}"), max_retries=max_retries
+            )
+
+        return self._snapshot_batch(snapshots, download, max_workers)
+
+    def iter_snapshots(
+        self,
+        snapshots: VideoSnapshotTaskResult | list[str],
+        *,
+        max_workers: int = 8,
+        max_retries: int = 3,
+    ) -> BatchIter[bytes]:
+        """Fetch the frames of a `video_snapshot` task concurrently and yield
+        the content of each image file in the order of the frames.
+
+        At most `max_workers * 2` frames are held in memory at a time. Failures
+        are collected in `errors` as with `download_snapshots`.
+        """
+
+        def read(i: int, r: Resource) -> bytes:
+            f = io.BytesIO()
+            self._download(DownloadState(r.url, f), max_retries, DOWNLOAD_CHUNK_SIZE)
+            return f.getvalue()
+
+        return self._snapshot_batch(snapshots, read, max_workers)
+
+    def stack_snapshots(
+        self,
+        snapshots: VideoSnapshotTaskResult | list[str],
+        *,
+        mode: str = "RGB",
+        max_workers: int = 8,
+        max_retries: int = 3,
+    ) -> Any:
+        """Fetch and decode the frames of a `video_snapshot` task into a single
+        NumPy array of shape `(frames, height, width, channels)`.
+
+        Frames are decoded as they arrive, so only the output array and a few
+        encoded images are in memory. Requires `numpy` and `Pillow`.
+
+        Args:
+            snapshots: The result of a `video_snapshot` task or its image ids.
+            mode: The Pillow image mode to convert every frame to.
+            max_workers: See `iter_snapshots`.
+            max_retries: See `download_resource`.
+        """
+        import numpy as np
+
+        n = len(snapshot_ids(snapshots))
+        frames = self.iter_snapshots(
+            snapshots, max_workers=max_workers, max_retries=max_retries
+        )
+        batch = None
+        for i, content in enumerate(frames):
+            frame = decode_image(content, mode)
+            if batch is None:
+                batch = np.empty((n, *frame.shape), frame.dtype)
+            batch[i] = frame
+        if frames.errors:
+            raise next(iter(frames.errors.values()))
+        return batch if batch is not None else np.empty((0, 0, 0, len(mode)))
+
     def delete_resource(self, id: str) -> None:
         self._request(bool, "delete", f"/resource/{id}")
+        if self._upload_index is not None:
+            self._upload_index.invalidate(self._scope, id)
+        if self._resource_cache is not None:
+            self._resource_cache.invalidate(self._scope, id)
 
     #####
     def list_webhook(self) -> list[WebhookResponse]:
@@ -272,68 +841,224 @@ class YiDong:
         page: int = 1,
         page_size: int = 10,
         ids: list[str] | None = None,
+    ) -> Pagination[TaskContainer]:
+        if ids and page == 1 and len(ids) <= page_size and self._task_cache is not None:
+            cached = self._task_cache.get_many(self._scope, ids)
+            misses = [i for i in ids if i not in cached]
+            fetched = None
+            if misses:
+                fetched = self._list_task(page, page_size, misses)
+            return merge_cached_tasks(ids, cached, fetched, page_size)
+        return self._list_task(page, page_size, ids)
+
+    def _list_task(
+        self, page: int, page_size: int, ids: list[str] | None
     ) -> Pagination[TaskContainer]:
         params = {"page": page, "page_size": page_size}
         if ids:
             params["ids"] = ids
-        return self._request(Pagination[TaskContainer], "get", "/task", params=params)
+        res = self._request(Pagination[TaskContainer], "get", "/task", params=params)
+        if self._task_cache is not None:
+            self._task_cache.put_many(self._scope, res.list)
+        if self._metrics is not None:
+            self._metrics.observe_tasks(res.list)
+        return res
 
-    def list_task_iter(self, **kwargs) -> PaginationIter[TaskContainer]:
-        return PaginationIter[TaskContainer](lambda p: self.list_task(page=p, **kwargs))
+    def list_task_iter(
+        self,
+        page_size: int = 100,
+        prefetch: int = 4,
+        limit: int | None = None,
+        **kwargs,
+    ) -> PaginationIter[TaskContainer]:
+        """Iterate over all tasks, fetching up to `prefetch` pages ahead concurrently.
+
+        Args:
+            page_size: The number of tasks per request.
+            prefetch: The number of pages fetched ahead. 0 fetches one page at a time.
+            limit: Stop after this many tasks.
+        """
+        return PaginationIter[TaskContainer](
+            lambda p: self.list_task(page=p, page_size=page_size, **kwargs),
+            prefetch=prefetch,
+            limit=limit,
+        )
 
     def _get_task(self, id: str) -> TaskContainer:
-        return self._request(TaskContainer, "get", f"/task/{id}")
+        if self._task_cache is not None:
+            if t := self._task_cache.get(self._scope, id):
+                return t
+        if self._task_loader is not None:
+            return self._task_loader.load(id)
+        return self._fetch_task(id)
+
+    def _fetch_task(self, id: str) -> TaskContainer:
+        t = self._request(TaskContainer, "get", f"/task/{id}")
+        if self._task_cache is not None:
+            self._task_cache.put(self._scope, t)
+        if self._metrics is not None:
+            self._metrics.observe_tasks([t])
+        return t
+
+    def _fetch_tasks(self, ids: list[str]) -> dict[str, TaskContainer]:
+        page = self._list_task(1, len(ids), ids)
+        return {t.id: t for t in page.list}
 
     def get_task(
         self,
         id: str,
         block: bool = True,
-        poll_interval: float = 1.0,
+        poll_interval: float | None = None,
         timeout: float = 0,
+        poll_policy: PollPolicy | None = None,
+        on_progress: ProgressHandler | None = None,
     ) -> TaskContainer:
         """Get the task detail with the given task id.
 
         Args:
-            id: The task id. block: Whether to block the request until the task is completed.
-            poll_interval: The interval to poll the task status.
+            id: The task id.
+            block: Whether to block the request until the task is completed.
+            poll_interval: If set, poll the task status at this fixed interval
+                instead of following `poll_policy`.
             timeout: The maximum time to wait for the task to finish. By default it will wait infinitely.
+            poll_policy: How long to wait between two polls. By default it
+                depends on the task type, see `yidong.polling.POLL_POLICIES`.
+            on_progress: Called with the task whenever a new record shows up.
+                If not provided, the record is logged to the `yidong` logger.
         """
-        if block:
-            start = datetime.now()
-            while True:
-                t = self._get_task(id)
-                if t.is_done():
-                    return t
-                else:
-                    if t.records:
-                        print(
-                            f"{id}\t{t.records[-1].time}\t{t.records[-1].type.value}\t{t.records[-1].message}"
-                        )
-                now = datetime.now()
-                if timeout > 0 and (now - start).total_seconds() > timeout:
-                    raise TimeoutError(
-                        f"failed to fetch task [{id}] result within {timeout} seconds"
-                    )
-                sleep(poll_interval)
-        else:
+        if not block:
             return self._get_task(id)
 
+        if poll_interval is not None:
+            poll_policy = PollPolicy.fixed(poll_interval)
+        start = datetime.now()
+        attempt = 0
+        last = None
+        while True:
+            t = self._get_task(id)
+            if t.is_done():
+                return t
+            if t.records and t.records[-1] != last:
+                last = t.records[-1]
+                report_progress(t, on_progress)
+            elapsed = (datetime.now() - start).total_seconds()
+            if timeout > 0 and elapsed > timeout:
+                raise TimeoutError(
+                    f"failed to fetch task [{id}] result within {timeout} seconds"
+                )
+            poll_policy = poll_policy or default_poll_policy(t.task.type)
+            sleep(poll_policy.interval(attempt, elapsed, t))
+            attempt += 1
+
+    def as_completed(
+        self,
+        tasks: Iterable[TaskRef | str],
+        poll_interval: float | None = None,
+        timeout: float = 0,
+        batch_size: int = 100,
+        poll_policy: PollPolicy | None = None,
+    ) -> Iterator[TaskContainer]:
+        """Wait for many tasks at once and yield each of them as soon as it is
+        done, in the order of completion.
+
+        Instead of polling every task separately, the status of all pending
+        tasks is fetched with batched `list_task(ids=...)` calls and finished
+        tasks are dropped from the next round.
+
+        Args:
+            tasks: Task references or task ids.
+            poll_interval: If set, poll at this fixed interval instead of
+                following `poll_policy`.
+            timeout: The maximum time to wait for all tasks to finish. By default it will wait infinitely.
+            batch_size: The maximum number of task ids in one `list_task` call.
+            poll_policy: How long to wait between two polling rounds.
+        """
+        pending = {}
+        for t in tasks:
+            if isinstance(t, TaskRef):
+                pending[t.tid] = t
+            else:
+                pending[t] = None
+        if poll_interval is not None:
+            poll_policy = PollPolicy.fixed(poll_interval)
+        poll_policy = poll_policy or PollPolicy()
+        start = datetime.now()
+        attempt = 0
+        while pending:
+            ids = list(pending)
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i : i + batch_size]
+                page = self.list_task(page_size=len(batch), ids=batch)
+                found = {t.id: t for t in page.list}
+                for id in batch:
+                    # ids unknown to the server are left out of the list, so
+                    # look them up alone to raise the actual error
+                    t = found.get(id) or self.get_task(id, block=False)
+                    if t.is_done():
+                        if ref := pending.pop(id):
+                            ref.t = t
+                        yield t
+            if not pending:
+                return
+            elapsed = (datetime.now() - start).total_seconds()
+            if timeout > 0 and elapsed > timeout:
+                raise TimeoutError(
+                    f"failed to fetch results of {len(pending)} tasks within {timeout} seconds"
+                )
+            sleep(poll_policy.interval(attempt, elapsed))
+            attempt += 1
+
+    def wait_tasks(
+        self, tasks: Iterable[TaskRef | str], **kwargs
+    ) -> list[TaskContainer]:
+        """Wait for all tasks to finish and return them in the given order. See `as_completed`."""
+        tasks = list(tasks)
+        done = {t.id: t for t in self.as_completed(tasks, **kwargs)}
+        return [done[t.tid if isinstance(t, TaskRef) else t] for t in tasks]
+
     def delete_task(self, tid: str) -> bool:
+        if self._task_cache is not None:
+            self._task_cache.invalidate(self._scope, tid)
         return self._request(bool, "delete", f"/task/{tid}")
 
-    def _submit_task(self, payload: dict) -> TaskRef:
-        caller = inspect.currentframe().f_back.f_code.co_name
-        task_type, task_result_type = get_args(
-            inspect.signature(getattr(self, caller)).return_annotation
-        )
-        payload = payload | {"type": caller}
+    def _submit_task(self, task_type: str, payload: dict) -> TaskRef:
+        task_cls, _ = TASK_REGISTRY[task_type]
+        task = task_cls.model_validate(payload)
+        key = None
+        if self._task_memo is not None:
+            key = task_key(task)
+            if not FORCE_RERUN.get():
+                if ref := self._get_memoized(task_type, key):
+                    return ref
+        # the same key is sent on retries so the server creates the task only once
         res = self._request(
             TaskInfo,
             "post",
             "/task",
-            payload=TypeAdapter(Task).validate_python(payload).dict(),
+            content=task.model_dump_json(),
+            headers={
+                "Content-Type": "application/json",
+                "Idempotency-Key": uuid.uuid4().hex,
+            },
+            idempotent=True,
         )
-        return TaskRef[task_type, task_result_type](self, res.id)
+        if key is not None:
+            self._task_memo.put(self._scope, key, res.id)
+        return _TASK_REFS[task_type](self, res.id)
+
+    def _get_memoized(self, task_type: str, key: str) -> TaskRef | None:
+        if tid := self._task_memo.get(self._scope, key):
+            try:
+                t = self._get_task(tid)
+            except (YDUnknownError, YDInternalServerError):
+                # the task is gone on the server side
+                t = None
+            if t is not None and is_reusable(t):
+                ref = _TASK_REFS[task_type](self, tid)
+                ref.t = t
+                return ref
+            self._task_memo.invalidate(self._scope, key)
+        return None
 
     def image_generation(
         self,
@@ -342,34 +1067,56 @@ class YiDong:
         config: DiffusionConfig = DiffusionConfig(),
     ) -> TaskRef[ImageGenerationTask, ImageGenerationTaskResult]:
         """Generate images based on the given prompt or the reference image."""
-        return self._submit_task(locals())
+        return self._submit_task("image_generation", locals())
 
     def image_inpaint(
         self,
         image_id: str,
-        mask_base64: str,
+        mask_base64: str = "",
         prompt: str | None = None,
+        *,
+        mask: MaskLike | None = None,
     ) -> TaskRef[ImageInpaintTask, ImageInpaintTaskResult]:
-        """Image inpaint based on the mask image base64 string and the given prompt."""
-        return self._submit_task(locals())
+        """Image inpaint based on the mask image and the given prompt.
+
+        Args:
+            image_id: The id of the image resource.
+            mask_base64: The mask image encoded as a base64 string.
+            prompt: What to paint into the masked area.
+            mask: Instead of `mask_base64`, a path to a mask image, its raw
+                bytes, or a 2D array in which non-zero elements mark the area
+                to paint. Arrays are sent as compact 1-bit PNGs.
+        """
+        mask_base64 = resolve_mask(mask_base64, mask)
+        return self._submit_task("image_inpaint", locals())
 
     def image_remove(
         self,
         image_id: str,
-        mask_base64: str,
+        mask_base64: str = "",
+        *,
+        mask: MaskLike | None = None,
     ) -> TaskRef[ImageRemoveTask, ImageRemoveTaskResult]:
-        """Image remove based on the mask image base64 string."""
-        return self._submit_task(locals())
+        """Image remove based on the mask image.
+
+        Args:
+            image_id: The id of the image resource.
+            mask_base64: The mask image encoded as a base64 string.
+            mask: Instead of `mask_base64`, a path, raw bytes or a 2D array,
+                see `image_inpaint`.
+        """
+        mask_base64 = resolve_mask(mask_base64, mask)
+        return self._submit_task("image_remove", locals())
 
     def ping(self) -> TaskRef[PingTask, PingTaskResult]:
         """A simple task to test the health of the server."""
-        return self._submit_task(locals())
+        return self._submit_task("ping", locals())
 
     def video_concat(
         self, video_ids: list[str], chapters: list[Chapter] = []
     ) -> TaskRef[VideoConcatTask, VideoConcatTaskResult]:
         """Concatenate multiple videos into one. If `chapters` are provided, they should be of the same length as `video_ids`."""
-        return self._submit_task(locals())
+        return self._submit_task("video_concat", locals())
 
     def video_mashup(
         self,
@@ -393,7 +1140,7 @@ class YiDong:
             voice_style_text: The transcript of the voice style.
             lang: The language of the voice over text. We'll choose appropriate font and style based on the language. Make sure the voice style matches the language specified here.
         """
-        return self._submit_task(locals())
+        return self._submit_task("video_mashup", locals())
 
     def video_generation(
         self,
@@ -401,7 +1148,7 @@ class YiDong:
         image_id: str = "",
     ) -> TaskRef[VideoGenerationTask, VideoGenerationTaskResult]:
         """Generate video based on the given prompt and the reference image."""
-        return self._submit_task(locals())
+        return self._submit_task("video_generation", locals())
 
     def video_script(
         self,
@@ -414,7 +1161,7 @@ class YiDong:
         """
         Generate scripts based on a collection of video summarizations.
         """
-        return self._submit_task(locals())
+        return self._submit_task("video_script", locals())
 
     def video_snapshot(
         self, video_id: str, *, start: float = 0.0, step: int = 1, stop: float = 0.0
@@ -427,7 +1174,7 @@ class YiDong:
             step: The step between each snapshot. (Only integers are allowed for now)
             stop: The stop timestamp in seconds. If it is longer than the video duration, only the video duration will be used.
         """
-        return self._submit_task(locals())
+        return self._submit_task("video_snapshot", locals())
 
     def video_summary(
         self,
@@ -448,11 +1195,53 @@ class YiDong:
             chapters: The list of video chapters. If not set, the `chapters` will be extracted automatically.
             display_lang: The language for selling_points, product name and so on
         """
-        return self._submit_task(locals())
+        return self._submit_task("video_summary", locals())
+
+
+def _cli_component(argv: list[str]) -> type:
+    """Only expose the requested subcommand so that jsonargparse does not
+    have to introspect the signatures of all the other methods.
+
+    The command runs on a real `YiDong` instance, so it can call any other
+    method of the client."""
+    commands = [k for k, v in vars(YiDong).items() if callable(v) and k[0] != "_"]
+    command = next((a for a in argv if a in commands), None)
+    if command is None:
+        return YiDong
+    method = getattr(YiDong, command)
+
+    @wraps(YiDong.__init__)
+    def __init__(self, *args, **kwargs) -> None:
+        self._client = YiDong(*args, **kwargs)
+
+    @wraps(method)
+    def run(self, *args, **kwargs):
+        return method(self._client, *args, **kwargs)
+
+    return type(
+        YiDong.__name__,
+        (),
+        {"__init__": __init__, command: run, "__doc__": YiDong.__doc__},
+    )
 
 
 def main():
-    rich.print(CLI(YiDong))
+    # CLI only dependencies are imported here to keep `import yidong` fast
+    import rich
+    from jsonargparse import CLI
+    from rich.logging import RichHandler
+
+    logger = logging.getLogger("yidong")
+    logger.addHandler(RichHandler())
+    logger.setLevel(logging.INFO)
+    res = CLI(_cli_component(sys.argv[1:]))
+    if isinstance(res, (BatchIter, PaginationIter, GeneratorType)):
+        for x in res:
+            rich.print(x)
+        for k, e in getattr(res, "errors", {}).items():
+            rich.print(f"[red]{k}[/red]: {e!r}")
+    else:
+        rich.print(res)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,73 @@
+import httpx
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 
+class HTTPConfig(BaseModel):
+    """Connection pool and timeout settings of an HTTP transport.
+
+    `http2` requires the `h2` package, e.g. `pip install httpx[http2]`.
+    """
+
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 30.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 5.0
+    http2: bool = False
+
+    def client_kwargs(self) -> dict:
+        return {
+            "timeout": httpx.Timeout(
+                connect=self.connect_timeout,
+                read=self.read_timeout,
+                write=self.write_timeout,
+                pool=self.pool_timeout,
+            ),
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "http2": self.http2,
+        }
+
+
+class StorageHTTPConfig(HTTPConfig):
+    """Uploads and downloads of resource files take much longer than API calls."""
+
+    read_timeout: float = 300.0
+    write_timeout: float = 300.0
+    keepalive_expiry: float = 30.0
+
+
 class Config(BaseSettings):
     api_key: str = ""
     api_key_header: str = "x-api-key"
     base_url: str = "https://api-yidong.lingyiwanwu.com/v1"
+    cache_dir: str = "~/.cache/yidong"
+    upload_dedup: bool = False
+    task_cache: bool = False
+    task_cache_size: int = 256 * 1024 * 1024
+    task_memo: bool = False
+    task_memo_ttl: float = 24 * 3600
+    resource_cache: bool = False
+    resource_cache_size: int = 10000
+    resource_cache_ttl: float = 300
+    coalesce_window: float = 0
+    max_retries: int = 3
+    rate_limit: float = 0
+    rate_burst: int = 0
+    max_in_flight: int = 0
+    # e.g. YIDONG_HTTP__HTTP2=true, YIDONG_STORAGE_HTTP__READ_TIMEOUT=600
+    http: HTTPConfig = HTTPConfig()
+    storage_http: StorageHTTPConfig = StorageHTTPConfig()
 
     class Config:
         env_prefix = "YIDONG_"
+        env_nested_delimiter = "__"
 
 
 CONFIG = Config()
@@ -30,6 +30,25 @@ class YDResourceNotUploadedError(YDError):
     ...
 
 
+class YDUploadError(YDError):
+    def __init__(self, url, message):
+        self.url = url
+        self.message = message
+
+
+class YDDownloadError(YDError):
+    def __init__(self, url, message, status_code=None):
+        self.url = url
+        self.message = message
+        self.status_code = status_code
+
+
+class YDTaskFailedError(YDError):
+    def __init__(self, task_id, message):
+        self.task_id = task_id
+        self.message = message
+
+
 def convert_reply_to_error(reply: Reply):
     if reply.code == 0:
         return YDInvalidReplyError(reply)
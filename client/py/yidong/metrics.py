@@ -0,0 +1,393 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Iterable
+
+import httpx
+from yidong.model import TaskContainer, TaskRecordType
+
+# seconds, from fast API calls up to long running video tasks
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+    1800,
+    3600,
+)
+
+STORAGE = "storage"
+
+
+def endpoint(method: str, path: str) -> str:
+    """The label of a request, e.g. `GET /task/{id}` for `GET /task/0a1b`."""
+    first, *rest = path.strip("/").split("/")
+    return f"{method.upper()} /" + "/".join([first] + ["{id}"] * len(rest))
+
+
+def error_code(e: Exception) -> int | str:
+    """The reply code or HTTP status of an error, or its class name."""
+    return getattr(e, "status_code", None) or type(e).__name__
+
+
+def task_timing(t: TaskContainer) -> tuple[float | None, float | None]:
+    """Seconds a finished task spent queued before processing, and processing.
+
+    Derived from the server timestamps of its records. Either is `None` if the
+    records do not tell.
+    """
+    try:
+        times = {r.type: datetime.fromisoformat(r.time) for r in reversed(t.records)}
+        created = datetime.fromisoformat(t.records[0].time)
+        done = datetime.fromisoformat(t.records[-1].time)
+    except (IndexError, ValueError):
+        return None, None
+    if (processing := times.get(TaskRecordType.processing)) is None:
+        return None, None
+    return (
+        max((processing - created).total_seconds(), 0.0),
+        max((done - processing).total_seconds(), 0.0),
+    )
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip((*self.buckets, float("inf")), self.counts)),
+        }
+
+
+class MetricsListener:
+    """Receives every observation of `Metrics`. Override the methods of interest."""
+
+    def on_request(
+        self,
+        endpoint: str,
+        status: int | str,
+        start: float,
+        seconds: float,
+        sent: int,
+        received: int,
+    ) -> None:
+        pass
+
+    def on_retry(self, endpoint: str) -> None:
+        pass
+
+    def on_error(self, endpoint: str, code: int | str) -> None:
+        pass
+
+    def on_task(
+        self,
+        task_type: str,
+        status: str,
+        queued: float | None,
+        running: float | None,
+    ) -> None:
+        pass
+
+
+class Metrics(MetricsListener):
+    """Per endpoint and per task type statistics of a client.
+
+    Pass an instance to `YiDong(metrics=...)` to record the latency, status
+    and bytes of every API request, upload and download attempt, retries,
+    errors by reply code, and how long finished tasks were queued and running
+    according to their records. Nothing is recorded if no instance is given.
+
+    Read the numbers with `snapshot()` or `to_prometheus()`, or forward every
+    observation to `listeners`, e.g. an `OpenTelemetryListener`.
+
+    Example:
+
+        metrics = Metrics()
+        yd = YiDong(metrics=metrics)
+        ...
+        print(metrics.to_prometheus())
+    """
+
+    def __init__(
+        self,
+        listeners: Iterable[MetricsListener] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        max_tasks: int = 10000,
+    ) -> None:
+        """
+        Args:
+            listeners: Also receive every observation.
+            buckets: The upper bounds of the histogram buckets in seconds.
+            max_tasks: How many finished task ids are remembered so that a
+                task seen done many times is only counted once.
+        """
+        self.listeners = list(listeners)
+        self.buckets = tuple(buckets)
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self.latency: dict[str, Histogram] = {}
+        self.requests: Counter[tuple[str, int | str]] = Counter()
+        self.bytes_sent: Counter[str] = Counter()
+        self.bytes_received: Counter[str] = Counter()
+        self.retries: Counter[str] = Counter()
+        self.errors: Counter[tuple[str, int | str]] = Counter()
+        self.tasks: Counter[tuple[str, str]] = Counter()
+        self.task_queued: dict[str, Histogram] = {}
+        self.task_running: dict[str, Histogram] = {}
+        self._seen: OrderedDict[str, None] = OrderedDict()
+
+    def _histogram(self, histograms: dict[str, Histogram], key: str) -> Histogram:
+        if (h := histograms.get(key)) is None:
+            h = histograms[key] = Histogram(self.buckets)
+        return h
+
+    def observe(
+        self,
+        endpoint: str,
+        start: float,
+        resp: httpx.Response | None = None,
+        error: Exception | None = None,
+        received: int = 0,
+    ) -> None:
+        """Record one request attempt which started at `start` (`time.time()`)."""
+        seconds = time.time() - start
+        if resp is not None:
+            status = resp.status_code
+            sent = int(resp.request.headers.get("Content-Length") or 0)
+        else:
+            status = type(error).__name__
+            sent = 0
+        self.on_request(endpoint, status, start, seconds, sent, received)
+
+    def on_request(self, endpoint, status, start, seconds, sent, received) -> None:
+        with self._lock:
+            self._histogram(self.latency, endpoint).observe(seconds)
+            self.requests[endpoint, status] += 1
+            self.bytes_sent[endpoint] += sent
+            self.bytes_received[endpoint] += received
+        for listener in self.listeners:
+            listener.on_request(endpoint, status, start, seconds, sent, received)
+
+    def on_retry(self, endpoint: str) -> None:
+        with self._lock:
+            self.retries[endpoint] += 1
+        for listener in self.listeners:
+            listener.on_retry(endpoint)
+
+    def on_error(self, endpoint: str, code: int | str) -> None:
+        with self._lock:
+            self.errors[endpoint, code] += 1
+        for listener in self.listeners:
+            listener.on_error(endpoint, code)
+
+    def observe_tasks(self, tasks: Iterable[TaskContainer]) -> None:
+        """Record the finished tasks which have not been seen before."""
+        for t in tasks:
+            if not t.is_done():
+                continue
+            with self._lock:
+                if t.id in self._seen:
+                    continue
+                self._seen[t.id] = None
+                while len(self._seen) > self.max_tasks:
+                    self._seen.popitem(last=False)
+            queued, running = task_timing(t)
+            self.on_task(t.task.type, t.records[-1].type.value, queued, running)
+
+    def on_task(self, task_type, status, queued, running) -> None:
+        with self._lock:
+            self.tasks[task_type, status] += 1
+            if queued is not None:
+                self._histogram(self.task_queued, task_type).observe(queued)
+            if running is not None:
+                self._histogram(self.task_running, task_type).observe(running)
+        for listener in self.listeners:
+            listener.on_task(task_type, status, queued, running)
+
+    def snapshot(self) -> dict:
+        """All statistics as plain data."""
+        with self._lock:
+            return {
+                "latency": {k: h.snapshot() for k, h in self.latency.items()},
+                "requests": [
+                    {"endpoint": e, "status": s, "count": n}
+                    for (e, s), n in self.requests.items()
+                ],
+                "bytes_sent": dict(self.bytes_sent),
+                "bytes_received": dict(self.bytes_received),
+                "retries": dict(self.retries),
+                "errors": [
+                    {"endpoint": e, "code": c, "count": n}
+                    for (e, c), n in self.errors.items()
+                ],
+                "tasks": [
+                    {"task_type": t, "status": s, "count": n}
+                    for (t, s), n in self.tasks.items()
+                ],
+                "task_queued": {k: h.snapshot() for k, h in self.task_queued.items()},
+                "task_running": {k: h.snapshot() for k, h in self.task_running.items()},
+            }
+
+    def to_prometheus(self, prefix: str = "yidong") -> str:
+        """The statistics in the Prometheus text exposition format."""
+        lines = []
+
+        def counter(name: str, help: str, items: dict) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for labels, n in items.items():
+                lines.append(f"{prefix}_{name}{{{_labels(labels)}}} {n}")
+
+        def histogram(name: str, help: str, label: str, items: dict) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for key, h in items.items():
+                total = 0
+                for le, n in zip((*h.buckets, "+Inf"), h.counts):
+                    total += n
+                    labels = _labels({label: key, "le": le})
+                    lines.append(f"{prefix}_{name}_bucket{{{labels}}} {total}")
+                labels = _labels({label: key})
+                lines.append(f"{prefix}_{name}_sum{{{labels}}} {h.sum}")
+                lines.append(f"{prefix}_{name}_count{{{labels}}} {h.count}")
+
+        with self._lock:
+            histogram(
+                "request_duration_seconds",
+                "Duration of request attempts.",
+                "endpoint",
+                self.latency,
+            )
+            counter(
+                "requests_total",
+                "Request attempts by status.",
+                {
+                    (("endpoint", e), ("status", s)): n
+                    for (e, s), n in self.requests.items()
+                },
+            )
+            counter(
+                "sent_bytes_total",
+                "Request body bytes.",
+                {(("endpoint", e),): n for e, n in self.bytes_sent.items()},
+            )
+            counter(
+                "received_bytes_total",
+                "Response body bytes.",
+                {(("endpoint", e),): n for e, n in self.bytes_received.items()},
+            )
+            counter(
+                "retries_total",
+                "Retried requests.",
+                {(("endpoint", e),): n for e, n in self.retries.items()},
+            )
+            counter(
+                "errors_total",
+                "Failed requests by reply code or HTTP status.",
+                {
+                    (("endpoint", e), ("code", c)): n
+                    for (e, c), n in self.errors.items()
+                },
+            )
+            counter(
+                "tasks_total",
+                "Finished tasks by status.",
+                {
+                    (("task_type", t), ("status", s)): n
+                    for (t, s), n in self.tasks.items()
+                },
+            )
+            histogram(
+                "task_queued_seconds",
+                "Time finished tasks waited before processing.",
+                "task_type",
+                self.task_queued,
+            )
+            histogram(
+                "task_running_seconds",
+                "Time finished tasks spent processing.",
+                "task_type",
+                self.task_running,
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict | tuple) -> str:
+    items = labels.items() if isinstance(labels, dict) else labels
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+
+
+class OpenTelemetryListener(MetricsListener):
+    """Forward observations to OpenTelemetry instruments, and requests as spans.
+
+    Requires the `opentelemetry-api` package. The global meter and tracer
+    providers are used unless given.
+    """
+
+    def __init__(self, meter_provider=None, tracer_provider=None) -> None:
+        from opentelemetry import metrics, trace
+
+        meter = metrics.get_meter("yidong", meter_provider=meter_provider)
+        self.tracer = trace.get_tracer("yidong", tracer_provider=tracer_provider)
+        self.duration = meter.create_histogram(
+            "yidong.request.duration", unit="s", description="Request attempts"
+        )
+        self.sent = meter.create_counter("yidong.request.sent", unit="By")
+        self.received = meter.create_counter("yidong.request.received", unit="By")
+        self.retries = meter.create_counter("yidong.request.retries")
+        self.errors = meter.create_counter("yidong.request.errors")
+        self.queued = meter.create_histogram("yidong.task.queued", unit="s")
+        self.running = meter.create_histogram("yidong.task.running", unit="s")
+        self.tasks = meter.create_counter("yidong.task.finished")
+
+    def on_request(self, endpoint, status, start, seconds, sent, received) -> None:
+        attributes = {"endpoint": endpoint, "status": str(status)}
+        self.duration.record(seconds, attributes)
+        self.sent.add(sent, {"endpoint": endpoint})
+        self.received.add(received, {"endpoint": endpoint})
+        span = self.tracer.start_span(
+            endpoint, start_time=int(start * 1e9), attributes=attributes
+        )
+        span.end(end_time=int((start + seconds) * 1e9))
+
+    def on_retry(self, endpoint) -> None:
+        self.retries.add(1, {"endpoint": endpoint})
+
+    def on_error(self, endpoint, code) -> None:
+        self.errors.add(1, {"endpoint": endpoint, "code": str(code)})
+
+    def on_task(self, task_type, status, queued, running) -> None:
+        self.tasks.add(1, {"task_type": task_type, "status": status})
+        if queued is not None:
+            self.queued.record(queued, {"task_type": task_type})
+        if running is not None:
+            self.running.record(running, {"task_type": task_type})
@@ -0,0 +1,588 @@
+import argparse
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Mapping
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from pydantic import ValidationError
+from yidong.config import CONFIG
+from yidong.model import TASK_REGISTRY
+from yidong.webhook import SIGNATURE_HEADER, sign
+
+logger = logging.getLogger("yidong")
+
+Response = tuple[int, dict[str, str], bytes]
+
+# the scheme and host of the stand-in when it is used as an httpx transport
+TRANSPORT_ROOT = "http://yidong.mock"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 resets connections under load
+    request_queue_size = 1024
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def fake_result(server: "MockServer", task: dict) -> dict:
+    """A minimal but valid result of the given task. Generated files are
+    added as resources filled with `server.result_size` bytes."""
+    t = task["type"]
+    source = {"type": "task", "task_id": task["id"]}
+    new = lambda: server.add_blob(b"\0" * server.result_size, source=source)
+    if t == "ping":
+        return {"type": t}
+    if t == "video_generation":
+        return {"type": t, "video_ids": [new()]}
+    if t == "video_summary":
+        chapters = task.get("chapters") or [{"start": 0, "stop": 10}]
+        return {
+            "type": t,
+            "video_id": task["video_id"],
+            "video_summary": {"summary": "A video.", "meta": {}},
+            "chapters": chapters,
+            "chapters_ids": [new() for _ in chapters],
+            "chapter_summaries": [{"summary": "A chapter.", "meta": {}}]
+            * len(chapters),
+        }
+    if t == "video_script":
+        style = [
+            {
+                "video_id": e["video_id"],
+                "chapter_id": (e.get("chapters_ids") or [None])[0],
+                "chapter": e["chapters"][0],
+                "data": {"voice_over": "A voice over."},
+            }
+            for e in task["collection"]
+            if e["chapters"]
+        ]
+        return {"type": t, "styles": [style]}
+    if t == "video_mashup":
+        return {
+            "type": t,
+            "video_id": new(),
+            "raw_video_id": new(),
+            "voice_over_ids": [new() for _ in task["voice_overs"]],
+            "bgm_id": task["bgm_id"],
+            "chapter_ids": [],
+        }
+    if t == "video_concat":
+        return {"type": t, "video_id": new()}
+    if t == "video_snapshot":
+        n = int((task["stop"] - task["start"]) // max(task["step"], 1)) or 1
+        return {"type": t, "image_ids": [new() for _ in range(min(n, 100))]}
+    return {"type": t, "generated_image_ids": [new()]}
+
+
+class MockServer:
+    """An in-process stand-in for the YiDong API and its file storage.
+
+    It implements resources with pre-signed uploads and ranged downloads,
+    tasks, webhooks and the `Reply` envelope, keeping everything in memory.
+    A task succeeds `durations[type]` seconds after it is submitted, with a
+    fake result whose files can be downloaded. Latency and errors can be
+    injected to load test clients.
+
+    Run it on a local port with `start` (or as a context manager), or plug
+    `transport()` into an `httpx.Client` to skip sockets altogether.
+
+    Example:
+
+        with MockServer(default_duration=0.5, latency=0.01) as server:
+            yd = YiDong(api_key=server.api_key, base_url=server.base_url)
+            r = yd.add_resource("a.mp4")
+            yd.video_summary(r.id)()
+    """
+
+    def __init__(
+        self,
+        *,
+        api_key: str = "mock",
+        durations: Mapping[str, float] | None = None,
+        default_duration: float = 1.0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        fail_rate: float = 0.0,
+        result_size: int = 1024,
+        result_factory: Callable[["MockServer", dict], dict] = fake_result,
+        url_ttl: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int | None = None,
+    ) -> None:
+        """
+        Args:
+            api_key: The only api key accepted. Empty to accept any.
+            durations: Seconds from submission to completion by task type.
+            default_duration: The duration of the other task types.
+            latency: Seconds added to every response.
+            jitter: Each latency is randomized by +/- this ratio.
+            error_rate: The ratio of requests answered with `error_status`
+                instead of being processed.
+            error_status: The HTTP status of injected errors.
+            fail_rate: The ratio of tasks which end with a `fail` record.
+            result_size: The size of each file produced by tasks.
+            result_factory: Build the result of a finished task.
+            url_ttl: Seconds the storage urls handed out stay valid, after
+                which they are answered with 403. 0 means they never expire.
+            host: The host the HTTP server binds to.
+            port: The port the HTTP server binds to. A free port is picked if
+                it is 0.
+            seed: Seed of the random errors and failures.
+        """
+        self.api_key = api_key
+        self.durations = dict(durations or {})
+        self.default_duration = default_duration
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fail_rate = fail_rate
+        self.result_size = result_size
+        self.result_factory = result_factory
+        self.url_ttl = url_ttl
+        self.host = host
+        self.port = port
+        self.root = TRANSPORT_ROOT
+        self.stats: Counter[str] = Counter()
+
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self._resources: dict[str, dict] = {}
+        self._blobs: dict[str, bytes] = {}
+        self._tasks: dict[str, dict] = {}
+        self._idempotency_keys: dict[str, str] = {}
+        self._webhooks: dict[str, dict] = {}
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.root}/v1"
+
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}{next(self._ids):012x}"
+
+    #####
+
+    def add_blob(
+        self, data: bytes, name: str = "", mime: str = "", source: dict | None = None
+    ) -> str:
+        """Add an uploaded resource directly. Returns its id."""
+        rid = self._new_id("r")
+        with self._lock:
+            self._resources[rid] = self._new_resource(rid, name, mime, source)
+            self._resources[rid]["uploaded_at"] = _now()
+            self._blobs[rid] = data
+        return rid
+
+    def _new_resource(
+        self, rid: str, name: str, mime: str, source: dict | None = None
+    ) -> dict:
+        return {
+            "id": rid,
+            "mime": mime or "application/octet-stream",
+            "name": name or rid,
+            "source": source or {"type": "local_upload", "path": name or None},
+            "uploaded_at": "",
+            "created_at": _now(),
+            "updated_at": None,
+            "meta": None,
+            "url": f"{self.root}/storage/{rid}",
+        }
+
+    def _view_resource(self, res: dict) -> dict:
+        """The resource with its url pre-signed for `url_ttl` seconds."""
+        if self.url_ttl <= 0:
+            return res
+        return res | {"url": f"{res['url']}?Expires={int(time.time() + self.url_ttl)}"}
+
+    def _view_task(self, tid: str) -> dict:
+        """The current state of a task, finishing it if its time has come."""
+        t = self._tasks[tid]
+        if not t["done"]:
+            elapsed = time.monotonic() - t["started"]
+            if elapsed >= t["duration"]:
+                self._finish(t)
+            elif len(t["records"]) == 1 and elapsed >= t["duration"] / 2:
+                t["records"].append({"time": _now(), "type": "processing"})
+        return {k: t[k] for k in ("id", "task", "result", "records")}
+
+    def _finish(self, t: dict) -> None:
+        with self._lock:
+            if t["done"]:
+                return
+            t["done"] = True
+            if t["fail"]:
+                t["records"].append(
+                    {"time": _now(), "type": "fail", "message": "injected"}
+                )
+            else:
+                t["result"] = self.result_factory(self, {"id": t["id"], **t["task"]})
+                t["records"].append({"time": _now(), "type": "success"})
+            hooks = [h for h in self._webhooks.values() if h["status"] == "active"]
+        if hooks:
+            body = json.dumps(
+                {"code": 0, "message": "", "data": self._view_task(t["id"])}
+            ).encode()
+            threading.Thread(
+                target=self._deliver, args=(hooks, body), daemon=True
+            ).start()
+
+    def _deliver(self, hooks: list[dict], body: bytes) -> None:
+        for h in hooks:
+            headers = {
+                "Content-Type": "application/json",
+                SIGNATURE_HEADER: sign(body, h["secret"]),
+            }
+            try:
+                httpx.post(h["url"], content=body, headers=headers)
+            except httpx.HTTPError as e:
+                logger.warning("failed to deliver webhook event to %s: %r", h["url"], e)
+
+    def _timer(self, tid: str, duration: float) -> None:
+        # finish the task on time even if nobody polls it, for webhooks
+        timer = threading.Timer(duration, self._finish, args=(self._tasks[tid],))
+        timer.daemon = True
+        timer.start()
+
+    #####
+
+    def _reply(self, data: Any, code: int = 0, message: str = "") -> Response:
+        body = json.dumps({"code": code, "message": message, "data": data}).encode()
+        return 200, {"Content-Type": "application/json"}, body
+
+    def _page(self, items: list, query: dict[str, list[str]]) -> Response:
+        page = int(query.get("page", ["1"])[0])
+        page_size = int(query.get("page_size", ["10"])[0])
+        return self._reply(
+            {
+                "page": page,
+                "page_size": page_size,
+                "total": len(items),
+                "list": items[(page - 1) * page_size : page * page_size],
+            }
+        )
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        query: dict[str, list[str]],
+        headers: Mapping[str, str],
+        body: bytes,
+    ) -> Response:
+        """Process one request. Returns the status, headers and body of the response."""
+        if self.latency > 0:
+            time.sleep(
+                self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            )
+        method = method.upper()
+        headers = {k.lower(): v for k, v in headers.items()}
+        if self.error_rate > 0 and self._random.random() < self.error_rate:
+            self.stats["error"] += 1
+            return self.error_status, {}, b"injected error"
+
+        if path.startswith("/storage/"):
+            self.stats[f"{method} /storage"] += 1
+            if self.url_ttl > 0:
+                expires = query.get("Expires", ["0"])[0]
+                if not expires.isdigit() or int(expires) < time.time():
+                    return 403, {}, b"request has expired"
+            return self._storage(method, path.removeprefix("/storage/"), headers, body)
+        if not path.startswith("/v1/"):
+            return 404, {}, b""
+        if self.api_key and headers.get(CONFIG.api_key_header) != self.api_key:
+            return self._reply(None, 1001, "invalid api key")
+
+        parts = path.removeprefix("/v1/").strip("/").split("/")
+        route = f"{method} /{parts[0]}" + ("/{id}" if len(parts) > 1 else "")
+        self.stats[route] += 1
+        handler = {
+            "resource": self._resource,
+            "task": self._task,
+            "webhook": self._webhook,
+        }.get(parts[0])
+        if handler is None:
+            return 404, {}, b""
+        with self._lock:
+            try:
+                return handler(method, parts[1:], query, headers, body)
+            except KeyError as e:
+                return self._reply(None, 2001, f"not found: {e}")
+
+    def _storage(
+        self, method: str, rid: str, headers: dict[str, str], body: bytes
+    ) -> Response:
+        with self._lock:
+            res = self._resources.get(rid)
+            if res is None:
+                return 404, {}, b""
+            if method == "PUT":
+                self._blobs[rid] = body
+                res["uploaded_at"] = _now()
+                return 200, {}, b""
+            data = self._blobs.get(rid)
+        if data is None:
+            return 404, {}, b""
+        etag = f'"{zlib.crc32(data):08x}"'
+        rng = headers.get("range")
+        if rng and headers.get("if-range", etag) == etag:
+            start = int(rng.split("=")[1].split("-")[0])
+            if start >= len(data):
+                return 416, {"Content-Range": f"bytes */{len(data)}"}, b""
+            return (
+                206,
+                {
+                    "Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}",
+                    "ETag": etag,
+                },
+                data[start:],
+            )
+        return 200, {"ETag": etag}, data
+
+    def _resource(
+        self, method: str, parts: list[str], query, headers, body: bytes
+    ) -> Response:
+        if not parts:
+            if method == "PUT":
+                file = query.get("file", [""])[0]
+                if file.startswith(("http://", "https://")):
+                    source = {"type": "remote_download", "url": file}
+                    data = b"\0" * self.result_size
+                    return self._reply({"id": self.add_blob(data, file, "", source)})
+                rid = self._new_id("r")
+                name = file.replace("\\", "/").rsplit("/", 1)[-1]
+                self._resources[rid] = self._new_resource(
+                    rid, name, headers.get("content-type", "")
+                )
+                return (
+                    307,
+                    {
+                        "x-yds-resource-id": rid,
+                        "Location": self._view_resource(self._resources[rid])["url"],
+                    },
+                    b"",
+                )
+            items = list(self._resources.values())
+            if ids := query.get("ids"):
+                items = [self._resources[i] for i in ids if i in self._resources]
+            if sources := query.get("source"):
+                items = [r for r in items if r["source"]["type"] in sources]
+            return self._page([self._view_resource(r) for r in items], query)
+
+        res = self._resources[parts[0]]
+        if method == "DELETE":
+            del self._resources[parts[0]]
+            self._blobs.pop(parts[0], None)
+            return self._reply(True)
+        if method == "PATCH":
+            for k, v in json.loads(body or b"{}").items():
+                if v is not None:
+                    res[k] = v
+            res["updated_at"] = _now()
+        if not res["uploaded_at"]:
+            return self._reply(None, 2002, "resource not uploaded")
+        return self._reply(self._view_resource(res))
+
+    def _task(
+        self, method: str, parts: list[str], query, headers, body: bytes
+    ) -> Response:
+        if not parts:
+            if method == "POST":
+                return self._submit(headers, body)
+            ids = query.get("ids") or list(self._tasks)
+            return self._page(
+                [self._view_task(i) for i in ids if i in self._tasks], query
+            )
+        if method == "DELETE":
+            del self._tasks[parts[0]]
+            return self._reply(True)
+        return self._reply(self._view_task(parts[0]))
+
+    def _submit(self, headers: dict[str, str], body: bytes) -> Response:
+        if (key := headers.get("idempotency-key")) in self._idempotency_keys:
+            return self._reply({"id": self._idempotency_keys[key]})
+        try:
+            payload = json.loads(body)
+            task_cls, _ = TASK_REGISTRY[payload["type"]]
+            task = task_cls.model_validate(payload).model_dump(mode="json")
+        except (ValueError, KeyError, TypeError, ValidationError) as e:
+            return self._reply(None, 4000, f"invalid task: {e}")
+        tid = self._new_id("t")
+        duration = self.durations.get(task["type"], self.default_duration)
+        self._tasks[tid] = {
+            "id": tid,
+            "task": task,
+            "result": None,
+            "records": [{"time": _now(), "type": "created"}],
+            "started": time.monotonic(),
+            "duration": duration,
+            "fail": self._random.random() < self.fail_rate,
+            "done": False,
+        }
+        if key:
+            self._idempotency_keys[key] = tid
+        if self._webhooks:
+            self._timer(tid, duration)
+        return self._reply({"id": tid})
+
+    def _webhook(
+        self, method: str, parts: list[str], query, headers, body: bytes
+    ) -> Response:
+        if not parts:
+            if method == "POST":
+                payload = json.loads(body)
+                wid = self._new_id("w")
+                self._webhooks[wid] = {
+                    "user_id": "mock",
+                    "webhook_id": wid,
+                    "url": payload["url"],
+                    "secret": payload["secret"],
+                    "status": "active",
+                    "created_at": _now(),
+                    "updated_at": _now(),
+                }
+                return self._reply(self._webhooks[wid])
+            return self._page(list(self._webhooks.values()), query)
+        hook = self._webhooks[parts[0]]
+        if method == "DELETE":
+            del self._webhooks[parts[0]]
+            return self._reply(True)
+        if method == "PATCH":
+            hook.update(json.loads(body or b"{}"))
+            hook["updated_at"] = _now()
+        return self._reply(hook)
+
+    #####
+
+    def transport(self) -> httpx.MockTransport:
+        """An httpx transport serving requests in-process, for both sync and
+        async clients. Injected latency blocks the event loop of async clients.
+
+        Example:
+
+            yd._client = httpx.Client(base_url=server.base_url, transport=server.transport())
+        """
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            u = request.url
+            status, headers, body = self.handle(
+                request.method,
+                u.path,
+                parse_qs(u.query.decode()),
+                request.headers,
+                request.read(),
+            )
+            return httpx.Response(status, headers=headers, content=body)
+
+        return httpx.MockTransport(handler)
+
+    def start(self) -> str:
+        """Serve on `host:port` in a background thread. Returns the base url of the API."""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # send the headers and the body in one segment
+            disable_nagle_algorithm = True
+            wbufsize = 64 * 1024
+
+            def _handle(self):
+                u = urlsplit(self.path)
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    body = self._read_chunked()
+                else:
+                    body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, headers, body = server.handle(
+                    self.command, u.path, parse_qs(u.query), dict(self.headers), body
+                )
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _read_chunked(self) -> bytes:
+                chunks = []
+                while size := int(self.rfile.readline().split(b";")[0], 16):
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                self.rfile.readline()
+                return b"".join(chunks)
+
+            do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = do_HEAD = _handle
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._server = _Server((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self.root = f"http://{self.host}:{self.port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread.join()
+            self._thread = None
+        self.root = TRANSPORT_ROOT
+
+    def __enter__(self) -> "MockServer":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in YiDong server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--api-key", default="mock")
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockServer(
+        api_key=args.api_key,
+        default_duration=args.duration,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        fail_rate=args.fail_rate,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"serving on {server.start()}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
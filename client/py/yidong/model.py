@@ -1,11 +1,17 @@
 from enum import Enum, StrEnum
-from typing import Annotated, Generic, Literal, List, TypeVar, Union
+from typing import Annotated, Generic, Literal, List, TypeVar, Union, get_args
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel as _BaseModel
+from pydantic import ConfigDict, Field
 
 T = TypeVar("T")
 
 
+class BaseModel(_BaseModel):
+    # validators are built on first use instead of at import time
+    model_config = ConfigDict(defer_build=True)
+
+
 class ResourceUploadResponse(BaseModel):
     id: str
 
@@ -159,6 +165,18 @@ class VideoScriptTaskElement(BaseModel):
     chapters: list[Chapter]
     chapter_summaries: list[Summary]
 
+    @classmethod
+    def from_summary(cls, r: VideoSummaryTaskResult) -> "VideoScriptTaskElement":
+        """Convert the result of a `video_summary` task. Missing summaries become empty ones."""
+        empty = Summary(summary="")
+        return cls(
+            video_id=r.video_id,
+            video_summary=r.video_summary or empty,
+            chapters_ids=r.chapters_ids,
+            chapters=r.chapters,
+            chapter_summaries=[s or empty for s in r.chapter_summaries],
+        )
+
 
 class VideoScriptTaskResultElement(BaseModel):
     video_id: str
@@ -408,6 +426,19 @@ TaskResult = Annotated[
 TaskResultType = TypeVar("TaskResultType", bound=TaskResult)
 
 
+def _task_type(model: type[BaseModel]) -> str:
+    return model.model_fields["type"].default
+
+
+_TASK_RESULTS = {_task_type(r): r for r in get_args(get_args(TaskResult)[0])}
+
+# task type -> (task model, task result model), built once at import time
+TASK_REGISTRY: dict[str, tuple[type[BaseModel], type[BaseModel]]] = {
+    _task_type(t): (t, _TASK_RESULTS[_task_type(t)])
+    for t in get_args(get_args(Task)[0])
+}
+
+
 #####
 class TaskRecordType(str, Enum):
     created = "created"
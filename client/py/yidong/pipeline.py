@@ -0,0 +1,220 @@
+import importlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable
+
+from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
+from yidong.exception import YDTaskFailedError
+from yidong.model import TaskRecordType
+from yidong.polling import PollPolicy
+from yidong.util import ResourceRef, TaskRef
+
+logger = logging.getLogger("yidong")
+
+
+class Step:
+    def __init__(
+        self, name: str, fn: Callable[..., Any], deps: tuple[str, ...]
+    ) -> None:
+        self.name = name
+        self.fn = fn
+        self.deps = deps
+
+
+def dump_output(value: Any) -> dict:
+    """The checkpoint entry of a step output which is not a task."""
+    if isinstance(value, ResourceRef):
+        return {"resource_id": value.rid, "meta": value.meta}
+    entry = {"value": to_jsonable_python(value)}
+    cls = type(value)
+    # parametrized generics and local classes cannot be looked up again
+    if isinstance(value, BaseModel) and not set("[<") & set(cls.__qualname__):
+        entry["type"] = f"{cls.__module__}:{cls.__qualname__}"
+    return entry
+
+
+def load_output(client: "YiDong", entry: dict) -> Any:
+    if "resource_id" in entry:
+        return ResourceRef(client, entry["resource_id"], **entry["meta"])
+    if "type" in entry:
+        module, _, qualname = entry["type"].partition(":")
+        cls = importlib.import_module(module)
+        for attr in qualname.split("."):
+            cls = getattr(cls, attr)
+        return cls.model_validate(entry["value"])
+    return entry["value"]
+
+
+class Pipeline:
+    """Run the steps of a workflow as soon as the steps they depend on are done.
+
+    A step is a function called with the outputs of its dependencies as
+    positional arguments. If it returns a `TaskRef`, the output of the step
+    is the result of the task once it succeeds. Steps run in a thread pool so
+    that independent branches overlap, and the tasks of all steps are polled
+    together with batched `list_task(ids=...)` calls.
+
+    If `checkpoint` is set, the ids of submitted tasks and the outputs of the
+    other steps are saved to that JSON file as soon as they are known. Running
+    the same pipeline again skips the finished steps and keeps waiting for the
+    tasks submitted before. Outputs of steps which do not return a task are
+    restored as the same pydantic model or `ResourceRef` they were, and any
+    other value as plain JSON.
+
+    Example:
+
+        p = Pipeline(yd, checkpoint="run.json")
+        for i, f in enumerate(files):
+            p.add(f"upload{i}", lambda f=f: yd.add_resource(f))
+            p.add(f"summary{i}", lambda r: yd.video_summary(r.id), f"upload{i}")
+        p.add(
+            "script",
+            lambda *rs: yd.video_script(
+                [VideoScriptTaskElement.from_summary(r) for r in rs],
+                remix_s1_prompt, remix_s2_prompt, references=[],
+            ),
+            *[f"summary{i}" for i in range(len(files))],
+        )
+        outputs = p.run()
+    """
+
+    def __init__(
+        self,
+        client: "YiDong",
+        checkpoint: str | None = None,
+        *,
+        max_workers: int = 8,
+        batch_size: int = 100,
+        poll_policy: PollPolicy | None = None,
+    ) -> None:
+        """
+        Args:
+            client: The client used to poll tasks.
+            checkpoint: The JSON file to save the progress to.
+            max_workers: The maximum number of steps running at the same time.
+                Steps waiting for their tasks do not count.
+            batch_size: The maximum number of task ids in one `list_task` call.
+            poll_policy: How long to wait between two polling rounds.
+        """
+        self.client = client
+        self.checkpoint = checkpoint
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.poll_policy = poll_policy or PollPolicy()
+        self.steps: dict[str, Step] = {}
+
+    def add(self, name: str, fn: Callable[..., Any], *deps: str) -> str:
+        """Add a step depending on the steps named `deps`, which must be added before. Returns the name."""
+        if name in self.steps:
+            raise ValueError(f"step [{name}] already exists")
+        for d in deps:
+            if d not in self.steps:
+                raise ValueError(f"step [{name}] depends on unknown step [{d}]")
+        self.steps[name] = Step(name, fn, deps)
+        return name
+
+    def _load(self) -> dict[str, dict]:
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return {}
+        with open(self.checkpoint) as f:
+            return json.load(f)
+
+    def _save(self, state: dict[str, dict]) -> None:
+        if self.checkpoint is None:
+            return
+        tmp = f"{self.checkpoint}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.checkpoint)
+
+    def run(self) -> dict[str, Any]:
+        """Run the steps which are not done yet. Returns the outputs of all steps by name."""
+        state = {k: v for k, v in self._load().items() if k in self.steps}
+        outputs: dict[str, Any] = {}
+        tasks: dict[str, str] = {}
+        for name, s in state.items():
+            if "task_id" in s:
+                tasks[s["task_id"]] = name
+            else:
+                outputs[name] = load_output(self.client, s)
+        started = set(state)
+        running: dict[Future, str] = {}
+
+        start = datetime.now()
+        next_poll = time.monotonic()
+        attempt = 0
+        executor = ThreadPoolExecutor(self.max_workers)
+        try:
+            while len(outputs) < len(self.steps):
+                for s in self.steps.values():
+                    if s.name not in started and all(d in outputs for d in s.deps):
+                        started.add(s.name)
+                        args = [outputs[d] for d in s.deps]
+                        running[executor.submit(s.fn, *args)] = s.name
+
+                timeout = max(next_poll - time.monotonic(), 0) if tasks else None
+                if running:
+                    done, _ = wait(running, timeout, return_when=FIRST_COMPLETED)
+                elif tasks:
+                    time.sleep(timeout)
+                    done = set()
+                else:
+                    raise RuntimeError("pipeline has no runnable steps left")
+
+                for fut in done:
+                    name = running.pop(fut)
+                    res = fut.result()
+                    if isinstance(res, TaskRef):
+                        logger.info("step %s submitted task %s", name, res.tid)
+                        tasks[res.tid] = name
+                        state[name] = {"task_id": res.tid}
+                        # poll new tasks early instead of at the backed off pace
+                        attempt = 0
+                        next_poll = min(
+                            next_poll, time.monotonic() + self.poll_policy.initial
+                        )
+                    else:
+                        logger.info("step %s is done", name)
+                        outputs[name] = res
+                        state[name] = dump_output(res)
+                    self._save(state)
+
+                if tasks and time.monotonic() >= next_poll:
+                    self._poll(tasks, outputs, state)
+                    elapsed = (datetime.now() - start).total_seconds()
+                    next_poll = time.monotonic() + self.poll_policy.interval(
+                        attempt, elapsed
+                    )
+                    attempt += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return {name: outputs[name] for name in self.steps}
+
+    def _poll(
+        self, tasks: dict[str, str], outputs: dict[str, Any], state: dict[str, dict]
+    ) -> None:
+        ids = list(tasks)
+        for i in range(0, len(ids), self.batch_size):
+            batch = ids[i : i + self.batch_size]
+            page = self.client.list_task(page_size=len(batch), ids=batch)
+            found = {t.id: t for t in page.list}
+            for id in batch:
+                # raises the actual error of an id unknown to the server
+                t = found.get(id) or self.client.get_task(id, block=False)
+                if not t.is_done():
+                    continue
+                name = tasks.pop(id)
+                if t.records[-1].type == TaskRecordType.fail:
+                    # submit it again on the next run
+                    del state[name]
+                    self._save(state)
+                    raise YDTaskFailedError(
+                        t.id, f"step [{name}] failed: {t.records[-1].message}"
+                    )
+                logger.info("step %s is done", name)
+                outputs[name] = t.result
@@ -0,0 +1,92 @@
+import logging
+import random
+from datetime import datetime
+from typing import Callable
+
+from pydantic import BaseModel
+from yidong.model import TaskContainer
+
+logger = logging.getLogger("yidong")
+
+ProgressHandler = Callable[[TaskContainer], None]
+
+
+def task_age(t: TaskContainer) -> float:
+    """Seconds between the first and the last record of the task, measured by the server clock."""
+    if len(t.records) < 2:
+        return 0.0
+    try:
+        first = datetime.fromisoformat(t.records[0].time)
+        last = datetime.fromisoformat(t.records[-1].time)
+    except ValueError:
+        return 0.0
+    return max((last - first).total_seconds(), 0.0)
+
+
+class PollPolicy(BaseModel):
+    """How long to wait between two polls of a task status.
+
+    The n-th interval grows exponentially as `initial * factor ** n`, but is
+    never shorter than `age_ratio` times the age of the task, so tasks that
+    have already been running for a long time are polled less often. The
+    result is capped by `max_interval` and randomized by +/- `jitter` so that
+    many waiters do not poll in lockstep.
+    """
+
+    initial: float = 1.0
+    factor: float = 1.5
+    max_interval: float = 30.0
+    jitter: float = 0.1
+    age_ratio: float = 0.1
+
+    @classmethod
+    def fixed(cls, interval: float) -> "PollPolicy":
+        return cls(
+            initial=interval, factor=1, max_interval=interval, jitter=0, age_ratio=0
+        )
+
+    def interval(
+        self, attempt: int, elapsed: float = 0.0, t: TaskContainer | None = None
+    ) -> float:
+        """The time to sleep after the `attempt`-th poll (starting from 0).
+
+        Args:
+            attempt: The number of polls made so far minus one.
+            elapsed: Seconds since the client started waiting.
+            t: The latest task status, if any.
+        """
+        age = max(elapsed, task_age(t)) if t is not None else elapsed
+        interval = max(self.initial * self.factor**attempt, age * self.age_ratio)
+        interval = min(interval, self.max_interval)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+POLL_POLICIES: dict[str, PollPolicy] = {
+    "ping": PollPolicy(initial=0.2, max_interval=2),
+    "image_generation": PollPolicy(initial=1, max_interval=10),
+    "image_inpaint": PollPolicy(initial=1, max_interval=10),
+    "image_remove": PollPolicy(initial=1, max_interval=10),
+    "video_snapshot": PollPolicy(initial=1, max_interval=15),
+    "video_concat": PollPolicy(initial=2, max_interval=30),
+    "video_summary": PollPolicy(initial=2, max_interval=30),
+    "video_script": PollPolicy(initial=2, max_interval=30),
+    "video_generation": PollPolicy(initial=5, max_interval=60),
+    "video_mashup": PollPolicy(initial=5, max_interval=60),
+}
+
+
+def default_poll_policy(task_type: str | None = None) -> PollPolicy:
+    """The default poll policy of the given task type. Tasks which usually
+    finish in seconds start polling sooner than long running video tasks."""
+    return POLL_POLICIES.get(task_type, PollPolicy())
+
+
+def report_progress(
+    t: TaskContainer, on_progress: ProgressHandler | None = None
+) -> None:
+    """Pass the task to `on_progress`, or log its latest record if not provided."""
+    if on_progress is not None:
+        on_progress(t)
+    elif t.records:
+        r = t.records[-1]
+        logger.info("%s\t%s\t%s\t%s", t.id, r.time, r.type.value, r.message)
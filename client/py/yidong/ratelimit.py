@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+from yidong.config import CONFIG
+
+
+class _Waiter:
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def wake(self) -> None:
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class RateLimiter:
+    """A token bucket combined with a limit on concurrent requests.
+
+    One limiter can be shared by any number of threads, event loops and client
+    instances. Use it as a context manager around each request, either with
+    `with limiter:` or `async with limiter:`.
+
+    Args:
+        rate: The sustained number of requests per second. 0 means unlimited.
+        burst: How many requests can be sent at once after being idle. By
+            default it is the same as `rate` (at least 1).
+        max_in_flight: The maximum number of requests in progress at the same
+            time. 0 means unlimited.
+    """
+
+    def __init__(self, rate: float = 0, burst: int = 0, max_in_flight: int = 0) -> None:
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.max_in_flight = max_in_flight
+
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._waiters: deque[_Waiter] = deque()
+
+    def _reserve(self) -> float:
+        """Take a token and return how long to wait until it is available."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def _enter(self, loop: asyncio.AbstractEventLoop | None = None) -> _Waiter | None:
+        """Take a request slot, or return a waiter to be woken up with one."""
+        with self._lock:
+            if self.max_in_flight <= 0 or self._in_flight < self.max_in_flight:
+                self._in_flight += 1
+                return None
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    def release(self) -> None:
+        if self.max_in_flight <= 0:
+            return
+        with self._lock:
+            if self._waiters:
+                # hand the slot over to the next waiter directly
+                self._waiters.popleft().wake()
+            else:
+                self._in_flight -= 1
+
+    def acquire(self) -> None:
+        if delay := self._reserve():
+            time.sleep(delay)
+        if waiter := self._enter():
+            waiter.event.wait()
+
+    async def aacquire(self) -> None:
+        if delay := self._reserve():
+            await asyncio.sleep(delay)
+        if waiter := self._enter(asyncio.get_running_loop()):
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = waiter.granted
+                    if not granted:
+                        self._waiters.remove(waiter)
+                if granted:
+                    self.release()
+                raise
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def __enter__(self) -> "RateLimiter":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+    async def __aenter__(self) -> "RateLimiter":
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.release()
+
+
+_DEFAULT_RATE_LIMITER: RateLimiter | None = None
+_DEFAULT_RATE_LIMITER_LOCK = threading.Lock()
+
+
+def default_rate_limiter() -> RateLimiter | None:
+    """The process wide limiter configured by `CONFIG.rate_limit`,
+    `CONFIG.rate_burst` and `CONFIG.max_in_flight`, shared by all clients
+    which are not given their own. `None` if no limit is configured."""
+    global _DEFAULT_RATE_LIMITER
+    if CONFIG.rate_limit <= 0 and CONFIG.max_in_flight <= 0:
+        return None
+    with _DEFAULT_RATE_LIMITER_LOCK:
+        if _DEFAULT_RATE_LIMITER is None:
+            _DEFAULT_RATE_LIMITER = RateLimiter(
+                CONFIG.rate_limit, CONFIG.rate_burst, CONFIG.max_in_flight
+            )
+        return _DEFAULT_RATE_LIMITER
@@ -0,0 +1,113 @@
+import logging
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+import httpx
+from pydantic import BaseModel
+
+logger = logging.getLogger("yidong")
+
+# `PUT /resource` creates a new resource each time, so `PUT` is left out
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "DELETE"}
+
+# the request never reached the server, so it is safe to send it again
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class RetryEvent(BaseModel):
+    method: str
+    url: str
+    attempt: int
+    delay: float
+    status_code: int | None = None
+    error: str | None = None
+
+
+RetryHook = Callable[[RetryEvent], None]
+
+
+class RetryPolicy(BaseModel):
+    """When and how long to wait before sending a failed API request again.
+
+    Network errors and responses with a status in `retry_statuses` are only
+    retried for idempotent requests: `GET`, `DELETE` and requests carrying an
+    idempotency key. Connection failures and `429 Too Many
+    Requests` are always retried since the server did not process the
+    request. The delay grows exponentially from `backoff` up to `max_backoff`
+    unless the server sends a `Retry-After` header.
+    """
+
+    max_retries: int = 3
+    backoff: float = 0.5
+    factor: float = 2.0
+    max_backoff: float = 30.0
+    jitter: float = 0.1
+    max_retry_after: float = 120.0
+    retry_statuses: set[int] = {429, 500, 502, 503, 504}
+
+    def should_retry(
+        self,
+        attempt: int,
+        idempotent: bool,
+        resp: httpx.Response | None = None,
+        error: Exception | None = None,
+    ) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            return isinstance(error, UNSENT_ERRORS) or idempotent
+        if resp.status_code == 429:
+            return True
+        return resp.status_code in self.retry_statuses and idempotent
+
+    def delay(self, attempt: int, resp: httpx.Response | None = None) -> float:
+        if resp is not None and (retry_after := parse_retry_after(resp)) is not None:
+            return min(retry_after, self.max_retry_after)
+        delay = min(self.backoff * self.factor**attempt, self.max_backoff)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def parse_retry_after(resp: httpx.Response) -> float | None:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def notify_retry(
+    on_retry: RetryHook | None,
+    method: str,
+    url: str,
+    attempt: int,
+    delay: float,
+    resp: httpx.Response | None = None,
+    error: Exception | None = None,
+) -> None:
+    event = RetryEvent(
+        method=method.upper(),
+        url=url,
+        attempt=attempt + 1,
+        delay=delay,
+        status_code=resp.status_code if resp is not None else None,
+        error=repr(error) if error is not None else None,
+    )
+    logger.warning(
+        "retrying %s %s in %.2fs (attempt %d, %s)",
+        event.method,
+        event.url,
+        delay,
+        event.attempt,
+        event.status_code or event.error,
+    )
+    if on_retry is not None:
+        on_retry(event)
@@ -1,6 +1,233 @@
-from typing import Any, Callable, Generic, Iterable, Iterator, TypeVar
+import asyncio
+import base64
+import glob
+import hashlib
+import io
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
+from itertools import islice
+from typing import (
+    Annotated,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Generic,
+    Hashable,
+    Iterable,
+    Iterator,
+    TypeVar,
+    Union,
+)
 
-from yidong.model import Pagination, Resource, TaskContainer, TaskResultType, TaskType
+import httpx
+from pydantic import Field, TypeAdapter, ValidationError
+from yidong.exception import (
+    YDDownloadError,
+    YDInvalidReplyError,
+    YDUploadError,
+    convert_reply_to_error,
+)
+from yidong.model import (
+    Pagination,
+    Reply,
+    Resource,
+    TaskContainer,
+    TaskResultType,
+    TaskType,
+    VideoSnapshotTaskResult,
+)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# the most ids looked up by a single `list_resource` or `list_task` request
+LOOKUP_PAGE_SIZE = 100
+RESOURCE_SOURCES = ["local_upload", "remote_download", "task"]
+
+ProgressCallback = Callable[[int, int], None]
+
+
+@lru_cache(maxsize=None)
+def reply_adapter(T: type) -> tuple[type[Reply], TypeAdapter]:
+    """A compiled validator of `Reply[T]` falling back to `Reply[Any]`, so
+    error replies are decoded in the same pass as successful ones."""
+    success = Reply[T]
+    return success, TypeAdapter(
+        Annotated[Union[success, Reply[Any]], Field(union_mode="left_to_right")]
+    )
+
+
+def decode_reply(T: type, content: bytes) -> Any:
+    """Decode the JSON reply of the server and return its `data` as `T`."""
+    success, adapter = reply_adapter(T)
+    try:
+        reply = adapter.validate_json(content)
+    except ValidationError:
+        raise YDInvalidReplyError(content)
+    if type(reply) is not success:
+        raise convert_reply_to_error(reply)
+    return reply.data
+
+
+def iter_file(
+    file: str,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    progress: ProgressCallback | None = None,
+) -> Iterator[bytes]:
+    """Read `file` in chunks, reporting `(bytes_sent, total_bytes)` to `progress`."""
+    total = os.path.getsize(file)
+    sent = 0
+    with open(file, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+            sent += len(chunk)
+            if progress:
+                progress(sent, total)
+
+
+async def aiter_file(
+    file: str,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    progress: ProgressCallback | None = None,
+) -> AsyncIterator[bytes]:
+    """Same as `iter_file`, but reads in a worker thread to not block the
+    event loop."""
+    total = await asyncio.to_thread(os.path.getsize, file)
+    sent = 0
+    f = await asyncio.to_thread(open, file, "rb")
+    try:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
+            sent += len(chunk)
+            if progress:
+                progress(sent, total)
+    finally:
+        f.close()
+
+
+def check_upload_response(url: str, resp: httpx.Response, retryable: bool) -> bool:
+    """Returns `True` if the upload succeeded and `False` if it should be retried."""
+    if resp.is_success:
+        return True
+    if resp.status_code >= 500 and retryable:
+        return False
+    raise YDUploadError(url, f"HTTP {resp.status_code}: {resp.text}")
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + tag
+        + data
+        + struct.pack(">I", zlib.crc32(tag + data))
+    )
+
+
+def _pack_bits(row: Iterable) -> bytes:
+    bits = 0
+    n = 0
+    for x in row:
+        bits = (bits << 1) | bool(x)
+        n += 1
+    pad = -n % 8
+    return (bits << pad).to_bytes((n + pad) // 8, "big")
+
+
+def encode_png_mask(mask: Any) -> bytes:
+    """Encode a 2D mask as a 1-bit grayscale PNG, in which every non-zero
+    element is white.
+
+    `mask` can be a NumPy array (or anything exposing `__array__`) of shape
+    `(height, width)`, or `(height, width, channels)` in which case only the
+    first channel is used, or a sequence of rows. Packing 8 pixels per byte
+    before deflating keeps the result several times smaller than an 8-bit
+    PNG of the same mask.
+    """
+    if hasattr(mask, "__array__"):
+        import numpy as np
+
+        a = np.asarray(mask)
+        if a.ndim == 3:
+            a = a[..., 0]
+        if a.ndim != 2 or not a.size:
+            raise ValueError(f"expected a 2D mask, got shape {a.shape}")
+        height, width = a.shape
+        packed = np.packbits(a != 0, axis=1)
+        rows = np.zeros((height, packed.shape[1] + 1), dtype=np.uint8)
+        rows[:, 1:] = packed
+        raw = rows.tobytes()
+    else:
+        height = len(mask)
+        width = len(mask[0]) if height else 0
+        if not width or any(len(row) != width for row in mask):
+            raise ValueError("expected a non-empty 2D mask with rows of equal length")
+        rows = [_pack_bits(row) for row in mask]
+        # every scanline starts with filter type 0 (None)
+        raw = b"".join(b"\0" + r for r in rows)
+    header = struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(raw, 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+MaskLike = Union[str, os.PathLike, bytes, bytearray, memoryview, Any]
+
+
+def encode_mask(mask: MaskLike) -> str:
+    """Turn any of the mask types accepted by `image_inpaint` and
+    `image_remove` into the base64 string expected by the server.
+
+    - a path (`str` or `os.PathLike`) to an image file
+    - the raw bytes of an encoded image
+    - an array or a sequence of rows, see `encode_png_mask`
+
+    Strings are always paths. Pass masks which are base64 already as
+    `mask_base64` instead.
+    """
+    if isinstance(mask, (str, os.PathLike)):
+        with open(mask, "rb") as f:
+            mask = f.read()
+    if not isinstance(mask, (bytes, bytearray, memoryview)):
+        mask = encode_png_mask(mask)
+    return base64.b64encode(mask).decode()
+
+
+def resolve_mask(mask_base64: str, mask: MaskLike | None) -> str:
+    """The `mask_base64` of a task given either it or `mask`."""
+    if mask is None:
+        return mask_base64
+    if mask_base64:
+        raise ValueError("pass either `mask_base64` or `mask`, not both")
+    return encode_mask(mask)
+
+
+def decode_image(content: bytes, mode: str = "RGB") -> Any:
+    """Decode an image file into a NumPy array of shape `(height, width,
+    channels)`. NumPy and Pillow are only imported when this is called."""
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(content)) as im:
+        return np.asarray(im.convert(mode))
+
+
+def snapshot_ids(snapshots: VideoSnapshotTaskResult | Iterable[str]) -> list[str]:
+    if isinstance(snapshots, VideoSnapshotTaskResult):
+        return snapshots.image_ids
+    return list(snapshots)
+
+
+def resource_file_name(r: Resource) -> str:
+    return r.name or f"{r.id}.{r.mime.split('/')[1]}"
 
 
 class ResourceRef:
@@ -46,27 +273,431 @@ T = TypeVar("T")
 
 
 class PaginationIter(Iterable[T], Generic[T]):
+    """Iterate over the items of all pages, starting from `start_page`.
+
+    Nothing is fetched before the first item is requested. The number of
+    pages is derived from `total` and `page_size` of the first page, then the
+    following pages are fetched by `prefetch` background threads while the
+    current one is consumed. At most `prefetch + 1` pages are held in memory.
+
+    Args:
+        page_getter: Fetch the page with the given page number.
+        start_page: The first page to fetch.
+        prefetch: The number of pages fetched ahead. 0 fetches one page at a
+            time.
+        limit: Stop after this many items, without fetching the pages beyond.
+    """
+
     def __init__(
-        self, page_getter: Callable[[int], Pagination[T]], start_page: int = 1
+        self,
+        page_getter: Callable[[int], Pagination[T]],
+        start_page: int = 1,
+        prefetch: int = 4,
+        limit: int | None = None,
     ) -> None:
         self.page_getter = page_getter
-        self.page: Pagination[T] = page_getter(start_page)
-
-        self.next_page = start_page + 1
-        self.next_ele_index = 0
+        self.start_page = start_page
+        self.prefetch = prefetch
+        self.limit = limit
+        self._items = self._iter_items()
 
     def __iter__(self) -> Iterator[T]:
         return self
 
     def __next__(self) -> T:
-        if self.next_ele_index < len(self.page.list):
-            x = self.page.list[self.next_ele_index]
-            self.next_ele_index += 1
-
-            if self.next_ele_index >= len(self.page.list):
-                self.page = self.page_getter(self.next_page)
-                self.next_page += 1
-                self.next_ele_index = 0
-            return x
+        return next(self._items)
+
+    def close(self) -> None:
+        """Stop early and cancel the pages which are not fetched yet."""
+        self._items.close()
+
+    def _iter_pages(self) -> Iterator[Pagination[T]]:
+        if self.limit is not None and self.limit <= 0:
+            return
+        page = self.page_getter(self.start_page)
+        yield page
+        if not page.list or page.page_size <= 0:
+            return
+
+        numbers = iter(range(self.start_page + 1, last_page(page, self.limit) + 1))
+        if self.prefetch <= 0:
+            for n in numbers:
+                page = self.page_getter(n)
+                yield page
+                if not page.list:
+                    return
+            return
+
+        executor = ThreadPoolExecutor(self.prefetch)
+        try:
+            pending = deque(
+                executor.submit(self.page_getter, n)
+                for n in islice(numbers, self.prefetch)
+            )
+            while pending:
+                page = pending.popleft().result()
+                if (n := next(numbers, None)) is not None:
+                    pending.append(executor.submit(self.page_getter, n))
+                yield page
+                if not page.list:
+                    return
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _iter_items(self) -> Iterator[T]:
+        remaining = self.limit
+        for page in self._iter_pages():
+            for x in page.list:
+                if remaining is not None:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                yield x
+
+
+def last_page(first: Pagination, limit: int | None = None) -> int:
+    """The number of the last page to fetch for at most `limit` items, given the first page."""
+    n = first.total
+    if limit is not None:
+        n = min(n, (first.page - 1) * first.page_size + limit)
+    return -(-n // first.page_size)
+
+
+class AsyncResourceRef(ResourceRef):
+    def __init__(self, client: "AsyncYiDong", rid: str, **kwargs) -> None:
+        super().__init__(client, rid, **kwargs)
+
+    async def __call__(self) -> Resource | None:
+        return await self.client.get_resource(self.rid)
+
+    def __repr__(self) -> str:
+        return f"AsyncResourceRef('{self.rid}', {self.meta})"
+
+
+class AsyncTaskRef(TaskRef[TaskType, TaskResultType]):
+    def __init__(self, client: "AsyncYiDong", tid: str) -> None:
+        super().__init__(client, tid)
+
+    async def __call__(self, **kwargs) -> TaskResultType | None:
+        if self.t is None or self.t.result is None:
+            self.t = await self.client.get_task(self.tid, **kwargs)
+        return self.t.result
+
+    def __await__(self):
+        return self().__await__()
+
+    def __repr__(self) -> str:
+        if self.t is None:
+            return f'AsyncTaskRef("{self.tid}")'
+        else:
+            return repr(self.t)
+
+
+class AsyncPaginationIter(AsyncIterator[T], Generic[T]):
+    """The asyncio version of `PaginationIter`, which prefetches pages in tasks."""
+
+    def __init__(
+        self,
+        page_getter: Callable[[int], Awaitable[Pagination[T]]],
+        start_page: int = 1,
+        prefetch: int = 4,
+        limit: int | None = None,
+    ) -> None:
+        self.page_getter = page_getter
+        self.start_page = start_page
+        self.prefetch = prefetch
+        self.limit = limit
+        self._items = self._iter_items()
+
+    def __aiter__(self) -> AsyncIterator[T]:
+        return self
+
+    async def __anext__(self) -> T:
+        return await self._items.__anext__()
+
+    async def aclose(self) -> None:
+        """Stop early and cancel the pages which are not fetched yet."""
+        await self._items.aclose()
+
+    async def _iter_pages(self) -> AsyncIterator[Pagination[T]]:
+        if self.limit is not None and self.limit <= 0:
+            return
+        page = await self.page_getter(self.start_page)
+        yield page
+        if not page.list or page.page_size <= 0:
+            return
+
+        numbers = iter(range(self.start_page + 1, last_page(page, self.limit) + 1))
+        if self.prefetch <= 0:
+            for n in numbers:
+                page = await self.page_getter(n)
+                yield page
+                if not page.list:
+                    return
+            return
+
+        pending = deque(
+            asyncio.ensure_future(self.page_getter(n))
+            for n in islice(numbers, self.prefetch)
+        )
+        try:
+            while pending:
+                page = await pending.popleft()
+                if (n := next(numbers, None)) is not None:
+                    pending.append(asyncio.ensure_future(self.page_getter(n)))
+                yield page
+                if not page.list:
+                    return
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+    async def _iter_items(self) -> AsyncIterator[T]:
+        remaining = self.limit
+        async for page in self._iter_pages():
+            for x in page.list:
+                if remaining is not None:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                yield x
+
+
+class DownloadState:
+    """Bookkeeping for a streaming, resumable download into a binary sink.
+
+    If `base` is given, it is the position in `f` where the first byte of the
+    remote object lives, and any bytes already present after it are treated as
+    a previously interrupted transfer to be resumed with an HTTP `Range`
+    request. Otherwise the content is written from the current position of `f`.
+    Once a response has been seen, resumed requests carry its `ETag` or
+    `Last-Modified` in `If-Range`, so a changed object is sent in full.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        f: BinaryIO,
+        base: int | None = None,
+        checksum: str | None = None,
+        checksum_algorithm: str = "sha256",
+    ) -> None:
+        self.url = url
+        self.f = f
+        self.checksum = checksum
+        self.checksum_algorithm = checksum_algorithm
+        self.total: int | None = None
+        self.validator: str | None = None
+        self.digest = hashlib.new(checksum_algorithm) if checksum else None
+        if base is None:
+            self.base = f.tell() if f.seekable() else 0
+            self.received = 0
+        else:
+            self.base = base
+            self.received = f.seek(0, os.SEEK_END) - base
+        if self.digest and self.received:
+            f.seek(base)
+            while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+                self.digest.update(chunk)
+
+    def headers(self) -> dict:
+        if not self.received:
+            return {}
+        headers = {"Range": f"bytes={self.received}-"}
+        if self.validator:
+            headers["If-Range"] = self.validator
+        return headers
+
+    def restart(self) -> None:
+        self.f.seek(self.base)
+        self.f.truncate()
+        self.received = 0
+        if self.digest:
+            self.digest = hashlib.new(self.checksum_algorithm)
+
+    def start(self, resp: httpx.Response) -> bool:
+        """Inspect the response headers. Returns `False` if nothing is left to read."""
+        if resp.status_code == 416 and self.received:
+            # `Content-Range: bytes */N` carries the size of the object
+            total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and int(total) == self.received:
+                # the previous attempt already got every byte
+                self.total = self.received
+                return False
+            # the partial file does not belong to this object, start over
+            self.restart()
+            if not total.isdigit():
+                resp.raise_for_status()
+            # left incomplete, so that the full body is fetched again
+            self.total = int(total)
+            return False
+        resp.raise_for_status()
+        if self.received and resp.status_code != 206:
+            # the server ignored the `Range` header or the object has changed
+            # since the `If-Range` validator, and sent the full body
+            self.restart()
+        self.validator = (
+            resp.headers.get("ETag") or resp.headers.get("Last-Modified") or None
+        )
+        if content_range := resp.headers.get("Content-Range"):
+            total = content_range.rpartition("/")[2]
+            self.total = int(total) if total.isdigit() else None
+        elif content_length := resp.headers.get("Content-Length"):
+            self.total = self.received + int(content_length)
+        return True
+
+    def write(self, chunk: bytes) -> None:
+        self.f.write(chunk)
+        self.received += len(chunk)
+        if self.digest:
+            self.digest.update(chunk)
+
+    def is_complete(self) -> bool:
+        return self.total is None or self.received >= self.total
+
+    def verify(self, expected_size: int | None = None) -> None:
+        if expected_size is not None and self.received != expected_size:
+            raise YDDownloadError(
+                self.url, f"expected {expected_size} bytes, got {self.received}"
+            )
+        if self.digest and self.digest.hexdigest() != self.checksum.lower():
+            raise YDDownloadError(
+                self.url,
+                f"{self.checksum_algorithm} mismatch, expected {self.checksum}, got {self.digest.hexdigest()}",
+            )
+
+
+def expand_paths(paths_or_glob: str | Iterable[str]) -> Iterator[str]:
+    """Expand directories (recursively) and glob patterns into file paths."""
+    if isinstance(paths_or_glob, str):
+        paths_or_glob = [paths_or_glob]
+    for p in map(os.path.expanduser, paths_or_glob):
+        if os.path.isdir(p):
+            for root, _, files in os.walk(p):
+                for f in sorted(files):
+                    yield os.path.join(root, f)
+        elif glob.has_magic(p):
+            for f in sorted(glob.iglob(p, recursive=True)):
+                if os.path.isfile(f):
+                    yield f
         else:
-            raise StopIteration()
+            yield p
+
+
+K = TypeVar("K", bound=Hashable)
+
+
+class BatchIter(Iterator[T], Generic[T]):
+    """Apply `fn` to every item with a pool of threads and yield the results
+    as soon as they are completed, or in the order of `items` if `ordered`.
+
+    At most `max_workers * 2` items are scheduled at a time, so `items` can be
+    a lazy iterable of any size. Exceptions raised by `fn` do not stop the
+    iteration. Instead they are collected in `errors`, keyed by the item.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[K], T],
+        items: Iterable[K],
+        max_workers: int = 8,
+        ordered: bool = False,
+    ) -> None:
+        self.errors: dict[K, Exception] = {}
+        self._gen = self._run(fn, iter(items), max_workers, ordered)
+
+    def _run(
+        self,
+        fn: Callable[[K], T],
+        items: Iterator[K],
+        max_workers: int,
+        ordered: bool,
+    ) -> Iterator[T]:
+        executor = ThreadPoolExecutor(max_workers)
+        pending: dict[Future, K] = {}
+        try:
+            while True:
+                for x in items:
+                    pending[executor.submit(fn, x)] = x
+                    if len(pending) >= max_workers * 2:
+                        break
+                if not pending:
+                    return
+                if ordered:
+                    # dicts keep the insertion order, the oldest comes first
+                    done = [next(iter(pending))]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    x = pending.pop(fut)
+                    try:
+                        yield fut.result()
+                    except Exception as e:
+                        self.errors[x] = e
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def __iter__(self) -> Iterator[T]:
+        return self
+
+    def __next__(self) -> T:
+        return next(self._gen)
+
+
+async def _aiter(items: Iterable[K]) -> AsyncIterator[K]:
+    for x in items:
+        yield x
+
+
+class AsyncBatchIter(AsyncIterator[T], Generic[T]):
+    """The asyncio counterpart of `BatchIter`, running at most `max_workers`
+    coroutines at a time. `items` can also be an async iterable."""
+
+    def __init__(
+        self,
+        fn: Callable[[K], Awaitable[T]],
+        items: Iterable[K] | AsyncIterable[K],
+        max_workers: int = 8,
+        ordered: bool = False,
+    ) -> None:
+        self.errors: dict[K, Exception] = {}
+        if not isinstance(items, AsyncIterable):
+            items = _aiter(items)
+        self._gen = self._run(fn, aiter(items), max_workers, ordered)
+
+    async def _run(
+        self,
+        fn: Callable[[K], Awaitable[T]],
+        items: AsyncIterator[K],
+        max_workers: int,
+        ordered: bool,
+    ) -> AsyncIterator[T]:
+        pending: dict[asyncio.Task, K] = {}
+        try:
+            while True:
+                async for x in items:
+                    pending[asyncio.ensure_future(fn(x))] = x
+                    if len(pending) >= max_workers:
+                        break
+                if not pending:
+                    return
+                if ordered:
+                    done = [next(iter(pending))]
+                    await asyncio.wait(done)
+                else:
+                    done, _ = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    x = pending.pop(fut)
+                    try:
+                        yield fut.result()
+                    except Exception as e:
+                        self.errors[x] = e
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+    def __aiter__(self) -> AsyncIterator[T]:
+        return self
+
+    async def __anext__(self) -> T:
+        return await self._gen.__anext__()
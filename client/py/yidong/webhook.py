@@ -0,0 +1,273 @@
+import hashlib
+import hmac
+import inspect
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Mapping
+
+from pydantic import ValidationError
+from yidong.exception import YDError
+from yidong.model import TaskContainer
+from yidong.util import TaskRef
+
+logger = logging.getLogger("yidong")
+
+SIGNATURE_HEADER = "x-yds-signature"
+
+
+def sign(body: bytes, secret: str) -> str:
+    """The hex HMAC-SHA256 signature of a webhook body."""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def parse_event(body: bytes) -> TaskContainer:
+    """Parse a webhook body, either a bare task or a task wrapped in a `Reply`."""
+    data = json.loads(body)
+    if isinstance(data, dict) and "records" not in data and "data" in data:
+        data = data["data"]
+    return TaskContainer.model_validate(data)
+
+
+class WebhookReceiver:
+    """Resolve waiting tasks from webhook events instead of polling.
+
+    Register the receiver's url with `YiDong.add_webhook(url, secret)`, then
+    `watch` tasks to get futures that are completed as soon as the matching
+    event arrives. Every `fallback_interval` seconds the tasks which are still
+    pending are polled in batches with `list_task(ids=...)`, so missed events
+    only delay the result instead of losing it.
+
+    The receiver can run its own threaded HTTP server with `start`, or be
+    mounted into an existing server as an ASGI app.
+
+    Example:
+
+        with WebhookReceiver(yd, secret="s3cr3t", port=8000) as receiver:
+            t = yd.video_summary(video_id)
+            result = receiver.wait(t)
+    """
+
+    def __init__(
+        self,
+        client: "YiDong",
+        secret: str,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        public_url: str | None = None,
+        signature_header: str = SIGNATURE_HEADER,
+        fallback_interval: float = 30.0,
+        batch_size: int = 100,
+        max_done: int = 10000,
+    ) -> None:
+        """
+        Args:
+            client: The client used to poll for missed events.
+            secret: The secret registered with the webhook.
+            host: The host the builtin HTTP server binds to. Only local
+                connections are accepted by default, bind to e.g. `0.0.0.0`
+                to receive events from the server directly.
+            port: The port the builtin HTTP server binds to. A free port is
+                picked if it is 0.
+            public_url: The url the server reaches the receiver at, e.g. the
+                address of a reverse proxy or tunnel in front of it. It is
+                returned by `url` instead of the local address.
+            signature_header: The header holding the HMAC-SHA256 signature of
+                the request body.
+            fallback_interval: The interval to poll pending tasks. Set it to 0
+                to disable polling.
+            batch_size: The maximum number of task ids in one `list_task` call.
+            max_done: How many finished tasks are remembered for tasks which
+                complete before they are watched.
+        """
+        if inspect.iscoroutinefunction(getattr(client, "list_task", None)):
+            raise TypeError(
+                "WebhookReceiver polls with a synchronous client, use YiDong "
+                "instead of AsyncYiDong"
+            )
+        self.client = client
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        self.signature_header = signature_header.lower()
+        self.fallback_interval = fallback_interval
+        self.batch_size = batch_size
+        self.max_done = max_done
+
+        self._lock = threading.Lock()
+        self._pending: dict[str, tuple[Future, list[TaskRef]]] = {}
+        self._done: OrderedDict[str, TaskContainer] = OrderedDict()
+        self._stopped = threading.Event()
+        self._server: ThreadingHTTPServer | None = None
+        self._threads: list[threading.Thread] = []
+
+    def watch(self, task: TaskRef | str) -> Future:
+        """Get a future which is completed with the `TaskContainer` once the task is done."""
+        tid = task.tid if isinstance(task, TaskRef) else task
+        with self._lock:
+            if t := self._done.get(tid):
+                fut = Future()
+                fut.set_result(t)
+                if isinstance(task, TaskRef):
+                    task.t = t
+                return fut
+            fut, refs = self._pending.setdefault(tid, (Future(), []))
+            if isinstance(task, TaskRef):
+                refs.append(task)
+            return fut
+
+    def wait(self, task: TaskRef | str, timeout: float | None = None) -> TaskContainer:
+        return self.watch(task).result(timeout)
+
+    def resolve(self, t: TaskContainer) -> None:
+        """Complete the future of a finished task."""
+        with self._lock:
+            self._done[t.id] = t
+            self._done.move_to_end(t.id)
+            while len(self._done) > self.max_done:
+                self._done.popitem(last=False)
+            fut, refs = self._pending.pop(t.id, (None, []))
+        for ref in refs:
+            ref.t = t
+        if fut is not None:
+            fut.set_result(t)
+
+    def reject(self, tid: str, error: Exception) -> None:
+        """Fail the future of a task which cannot be fetched."""
+        with self._lock:
+            fut, _ = self._pending.pop(tid, (None, []))
+        if fut is not None:
+            fut.set_exception(error)
+
+    def handle(self, body: bytes, headers: Mapping[str, str]) -> int:
+        """Verify and process one webhook request. Returns the HTTP status code."""
+        headers = {k.lower(): v for k, v in headers.items()}
+        signature = headers.get(self.signature_header, "")
+        if not hmac.compare_digest(signature, sign(body, self.secret)):
+            logger.warning("rejected webhook event with an invalid signature")
+            return 401
+        try:
+            t = parse_event(body)
+        except (ValueError, ValidationError):
+            logger.warning("rejected malformed webhook event")
+            return 400
+        if t.is_done():
+            self.resolve(t)
+        return 200
+
+    def poll(self) -> None:
+        """Poll the pending tasks once."""
+        with self._lock:
+            ids = list(self._pending)
+        for i in range(0, len(ids), self.batch_size):
+            batch = ids[i : i + self.batch_size]
+            try:
+                page = self.client.list_task(page_size=len(batch), ids=batch)
+            except Exception as e:
+                logger.warning("failed to poll pending tasks: %r", e)
+                return
+            found = {t.id: t for t in page.list}
+            for id in batch:
+                try:
+                    # ids unknown to the server are left out of the list
+                    t = found.get(id) or self.client.get_task(id, block=False)
+                except YDError as e:
+                    self.reject(id, e)
+                    continue
+                except Exception as e:
+                    logger.warning("failed to poll task %s: %r", id, e)
+                    continue
+                if t.is_done():
+                    self.resolve(t)
+
+    @property
+    def url(self) -> str:
+        if self.public_url:
+            return self.public_url
+        return f"http://{self.host}:{self.port}/"
+
+    def start(self) -> str:
+        """Start the builtin HTTP server and the fallback poller in background threads. Returns the url."""
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send_response(receiver.handle(body, dict(self.headers)))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._stopped.clear()
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, daemon=True)
+        ]
+        if self.fallback_interval > 0:
+            self._threads.append(threading.Thread(target=self._run_poller, daemon=True))
+        for th in self._threads:
+            th.start()
+        return self.url
+
+    def start_poller(self) -> None:
+        """Only start the fallback poller, e.g. when mounted as an ASGI app."""
+        self._stopped.clear()
+        if self.fallback_interval > 0:
+            th = threading.Thread(target=self._run_poller, daemon=True)
+            self._threads.append(th)
+            th.start()
+
+    def _run_poller(self) -> None:
+        while not self._stopped.wait(self.fallback_interval):
+            self.poll()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for th in self._threads:
+            th.join()
+        self._threads = []
+
+    def __enter__(self) -> "WebhookReceiver":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    async def __call__(self, scope, receive, send) -> None:
+        """ASGI entrypoint."""
+        if scope["type"] != "http":
+            return
+        if scope["method"] != "POST":
+            status = 405
+        else:
+            body = b""
+            while True:
+                message = await receive()
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            headers = {
+                k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]
+            }
+            status = self.handle(body, headers)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-length", b"0")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b""})